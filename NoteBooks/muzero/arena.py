@@ -0,0 +1,173 @@
+import argparse
+import json
+import math
+import multiprocessing as mp
+import random
+import time
+import numpy as np
+from muzero.mcts import mcts_search
+from muzero.stats import Window
+
+# evaluation episodes played across processes, judging an agent on strength and on cost
+#   python -m muzero.arena --env tictactoe --agent numpy:model.npz --opponent random --episodes 400 --workers 4
+#   python -m muzero.arena --env CartPole-v0 --agent quantized:model-int8.npz --episodes 100
+# agents are given as picklable specs so every worker can build its own copy:
+#   random          uniform over the legal actions
+#   mock            mcts on the perfect TicTacToe model
+#   numpy:PATH      mcts on a muzero.npmodel export
+#   quantized:PATH  mcts on a muzero.quantize export
+# tictactoe is played against the opponent with the agent moving first in every other episode,
+# scored +1 win, 0 draw, -1 loss (an illegal move loses), any other env is played solo and scored by total reward
+
+def make_env(name):
+  if name == 'tictactoe':
+    from muzero.tictactoe import TicTacToe
+    return TicTacToe()
+  if name == 'follower':
+    from muzero.follower import Follower
+    return Follower()
+  import gym
+  return gym.make(name)
+
+def legal_actions(env, observation):
+  if hasattr(env, 'dynamics_batch'):
+    # TicTacToe, the empty cells
+    return [i for i in range(9) if observation[i] == 0]
+  return list(range(env.action_space.n))
+
+class Agent():
+  def __init__(self, spec, num_simulations=30, greedy=True, minimax=False):
+    self.spec = spec
+    self.num_simulations = num_simulations
+    self.greedy = greedy
+    self.minimax = minimax
+    kind, _, path = spec.partition(':')
+    if kind == 'random':
+      self.m = None
+    elif kind == 'mock':
+      from muzero.tictactoe import MockModel
+      self.m = MockModel()
+    elif kind == 'numpy':
+      from muzero.npmodel import load_numpy
+      self.m = load_numpy(path)
+    elif kind == 'quantized':
+      from muzero.quantize import load_quantized
+      self.m = load_quantized(path)
+    else:
+      raise ValueError("unknown agent %s" % spec)
+
+  def act(self, env, observation):
+    if self.m is None:
+      return random.choice(legal_actions(env, observation))
+    policy, _ = mcts_search(self.m, observation, self.num_simulations, self.minimax)
+    if self.greedy:
+      return int(np.argmax(policy))
+    return int(np.random.choice(len(policy), p=policy))
+
+def play_episode(env, agent, opponent=None, agent_first=True, max_moves=10000):
+  # returns score, moves by both sides, agent per-move latencies, whether the agent moved illegally
+  observation = env.reset()
+  total, latencies = 0, []
+  for moves in range(1, max_moves + 1):
+    # in tictactoe observation[-1] is the player to move and 1 moves first
+    mine = opponent is None or (observation[-1] == 1) == agent_first
+    if mine:
+      st = time.perf_counter()
+      a = agent.act(env, observation)
+      latencies.append(time.perf_counter() - st)
+    else:
+      a = opponent.act(env, observation)
+    observation, r, done, _ = env.step(a)
+    if opponent is None:
+      total += r
+    elif done:
+      # r is for the player that just moved
+      outcome = 1 if r == 1 else (-1 if r == -10 else 0)
+      return (outcome if mine else -outcome), moves, latencies, mine and r == -10
+    if done:
+      break
+  return total, moves, latencies, False
+
+# worker process state, built once by init_worker
+_worker = {}
+
+def init_worker(env_name, agent_spec, opponent_spec, num_simulations, greedy):
+  minimax = env_name == 'tictactoe'
+  _worker['env'] = make_env(env_name)
+  _worker['agent'] = Agent(agent_spec, num_simulations, greedy, minimax)
+  _worker['opponent'] = Agent(opponent_spec, num_simulations, greedy, minimax) if opponent_spec else None
+
+def run_episode(args):
+  episode, seed, max_moves = args
+  random.seed(seed + episode)
+  np.random.seed((seed + episode) % 2**32)
+  return play_episode(_worker['env'], _worker['agent'], _worker['opponent'], episode % 2 == 0, max_moves)
+
+def evaluate(env_name, agent_spec, opponent_spec=None, episodes=100, workers=1, num_simulations=30, greedy=True,
+             seed=0, max_moves=10000):
+  """Plays episodes of env_name with workers processes (0 plays in this process) and returns a report dict."""
+  if env_name == 'tictactoe' and opponent_spec is None:
+    opponent_spec = 'random'
+  init = (env_name, agent_spec, opponent_spec, num_simulations, greedy)
+  jobs = [(i, seed, max_moves) for i in range(episodes)]
+  st = time.perf_counter()
+  if workers == 0:
+    init_worker(*init)
+    results = [run_episode(j) for j in jobs]
+  else:
+    with mp.get_context('spawn').Pool(workers, initializer=init_worker, initargs=init) as pool:
+      # don't count process startup and model loading
+      pool.map(time.sleep, [0] * workers)
+      st = time.perf_counter()
+      results = pool.map(run_episode, jobs, chunksize=max(1, episodes // (4 * workers)))
+  wall = time.perf_counter() - st
+  return report(results, wall, env_name, agent_spec, opponent_spec, workers)
+
+def report(results, wall, env_name=None, agent_spec=None, opponent_spec=None, workers=None):
+  scores = np.array([r[0] for r in results], dtype=np.float64)
+  moves = sum(r[1] for r in results)
+  agent_moves = sum(len(r[2]) for r in results)
+  agent_time = sum(sum(r[2]) for r in results)
+  latency = Window(max(1, agent_moves))
+  for r in results:
+    latency.extend(np.array(r[2]) * 1000)
+  n = len(scores)
+  std = float(scores.std(ddof=1)) if n > 1 else 0.0
+  ret = {'env': env_name, 'agent': agent_spec, 'opponent': opponent_spec, 'workers': workers, 'episodes': n,
+         'score_mean': float(scores.mean()), 'score_std': std,
+         # normal approximation
+         'score_ci95': 1.96 * std / math.sqrt(n) if n > 1 else 0.0,
+         # how fast the agent alone picks moves, opponent turns don't count
+         'agent_moves': agent_moves, 'agent_moves_per_sec': agent_moves / agent_time if agent_time > 0 else 0.0,
+         # both sides, over the wall time of all the workers together
+         'moves': moves, 'wall_sec': wall, 'game_moves_per_sec': moves / wall if wall > 0 else 0.0,
+         'latency_ms': latency.summary()}
+  if opponent_spec is not None:
+    ret.update({'wins': int((scores > 0).sum()), 'draws': int((scores == 0).sum()), 'losses': int((scores < 0).sum()),
+                'illegal': int(sum(r[3] for r in results))})
+  return ret
+
+def main():
+  parser = argparse.ArgumentParser(description="MuZero evaluation arena")
+  parser.add_argument('--env', default='tictactoe', help="tictactoe, follower or a gym env id")
+  parser.add_argument('--agent', default='mock')
+  parser.add_argument('--opponent', help="tictactoe only, defaults to random")
+  parser.add_argument('--episodes', type=int, default=100)
+  parser.add_argument('--workers', type=int, default=1)
+  parser.add_argument('--simulations', type=int, default=30)
+  parser.add_argument('--sample', action='store_true', help="sample from the search policy instead of taking its argmax")
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--max-moves', type=int, default=10000)
+  parser.add_argument('--json', help="write the report here")
+  args = parser.parse_args()
+  ret = evaluate(args.env, args.agent, args.opponent, args.episodes, args.workers, args.simulations,
+                 not args.sample, args.seed, args.max_moves)
+  print("%s %s vs %s: %.3f +- %.3f over %d episodes, agent %.1f moves/sec, latency p50 %.2fms p99 %.2fms" % (
+    ret['env'], ret['agent'], ret['opponent'], ret['score_mean'], ret['score_ci95'], ret['episodes'],
+    ret['agent_moves_per_sec'], ret['latency_ms'].get('p50', 0), ret['latency_ms'].get('p99', 0)))
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(ret, f, indent=2)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,138 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+# training/inference throughput of MuModel over a grid of configs
+# every config runs in a fresh process, so TF thread settings apply and peak RSS is per config
+#
+#   python -m muzero.bench --layer-count 2,4 --layer-dim 64,128 --K 3,5 --batch 32,128 --threads 1:1,4:2 --json bench.json
+
+def synthetic_arrays(o_shape, a_dim, K, bs):
+  # shaped like batch_arrays(replay_buffer.sample_batch()), with some -1 padding actions
+  o = np.random.randn(bs, *o_shape).astype(np.float32)
+  a = np.random.randint(-1, a_dim, size=(bs, K))
+  v = np.random.randn(bs, K+1)
+  r = np.random.randn(bs, K+1)
+  p = np.random.dirichlet([1]*a_dim, size=(bs, K+1))
+  return o, a, v, r, p
+
+def timeit(fn, n):
+  ts = []
+  for _ in range(n):
+    st = time.perf_counter()
+    fn()
+    ts.append(time.perf_counter() - st)
+  return np.array(ts)
+
+def run_config(cfg):
+  import tensorflow as tf
+  tf.config.threading.set_intra_op_parallelism_threads(cfg['intra'])
+  tf.config.threading.set_inter_op_parallelism_threads(cfg['inter'])
+  from muzero.model import MuModel, one_hot, reformat_arrays
+
+  st = time.perf_counter()
+  m = MuModel(tuple(cfg['o_shape']), cfg['a_dim'], s_dim=cfg['s_dim'], K=cfg['K'], engine=cfg['engine'],
+              layer_count=cfg['layer_count'], layer_dim=cfg['layer_dim'])
+  build = time.perf_counter() - st
+  # the unrolled training graph is built lazily, time it on its own
+  st = time.perf_counter()
+  m.build_training()
+  build_training = time.perf_counter() - st
+
+  o, a, v, r, p = synthetic_arrays(m.o_shape, m.a_dim, m.K, cfg['batch'])
+  if cfg['engine'] == 'tf':
+    a = one_hot(a, m.a_dim)
+    step = lambda: m.train_on_arrays(o, a, v, r, p)
+  else:
+    X, Y = reformat_arrays(o, a, v, r, p, m.a_dim)
+    step = lambda: m.train_on_reformatted(X, Y)
+  # the first step traces/compiles
+  first = timeit(step, 1)[0]
+  train = timeit(step, cfg['steps'])
+
+  s = m.ht(o[0])
+  infer = {'ht': timeit(lambda: m.ht(o[0]), cfg['infer']),
+           'gt': timeit(lambda: m.gt(s, 0), cfg['infer']),
+           'ft': timeit(lambda: m.ft(s), cfg['infer'])}
+
+  ret = dict(cfg)
+  ret.update({
+    'build_sec': build,
+    'build_training_sec': build_training,
+    'first_step_sec': first,
+    'step_ms': 1000*float(train.mean()),
+    'step_p90_ms': 1000*float(np.percentile(train, 90)),
+    'samples_per_sec': cfg['batch'] / float(train.mean()),
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+  })
+  for k, t in infer.items():
+    ret['%s_us' % k] = 1e6*float(np.median(t))
+  return ret
+
+def ints(s):
+  return [int(x) for x in s.split(',')]
+
+COLUMNS = ['engine', 'layer_count', 'layer_dim', 's_dim', 'K', 'batch', 'intra', 'inter',
+           'build_sec', 'build_training_sec', 'step_ms', 'samples_per_sec', 'ht_us', 'gt_us', 'ft_us', 'peak_rss_mb']
+
+def print_table(rows):
+  cells = [[('%.3g' % r[c]) if isinstance(r[c], float) else str(r[c]) for c in COLUMNS] for r in rows]
+  widths = [max(len(c), *(len(x[i]) for x in cells)) for i, c in enumerate(COLUMNS)]
+  print("  ".join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+  for x in cells:
+    print("  ".join(c.rjust(w) for c, w in zip(x, widths)))
+
+def main():
+  parser = argparse.ArgumentParser(description="MuModel training/inference benchmark")
+  parser.add_argument('--o-dim', type=ints, default=[11])
+  parser.add_argument('--a-dim', type=int, default=9)
+  parser.add_argument('--layer-count', type=ints, default=[4])
+  parser.add_argument('--layer-dim', type=ints, default=[128])
+  parser.add_argument('--s-dim', type=ints, default=[8])
+  parser.add_argument('--K', type=ints, default=[5])
+  parser.add_argument('--batch', type=ints, default=[128])
+  parser.add_argument('--engine', default='tf', help="comma separated, tf and/or keras")
+  parser.add_argument('--threads', default='0:0', help="comma separated intra:inter, 0 lets TF decide")
+  parser.add_argument('--steps', type=int, default=50)
+  parser.add_argument('--infer', type=int, default=200)
+  parser.add_argument('--json', help="write {results: [rows], failed: [configs]} here")
+  parser.add_argument('--worker', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.worker:
+    print(json.dumps(run_config(json.loads(args.worker))))
+    return
+
+  threads = [tuple(int(x) for x in t.split(':')) for t in args.threads.split(',')]
+  grid = itertools.product(args.engine.split(','), args.layer_count, args.layer_dim, args.s_dim, args.K, args.batch, threads)
+  rows, failed = [], []
+  for engine, lc, ld, sd, K, bs, (intra, inter) in grid:
+    cfg = {'o_shape': args.o_dim, 'a_dim': args.a_dim, 'engine': engine, 'layer_count': lc, 'layer_dim': ld,
+           's_dim': sd, 'K': K, 'batch': bs, 'intra': intra, 'inter': inter, 'steps': args.steps, 'infer': args.infer}
+    out = subprocess.run([sys.executable, '-m', 'muzero.bench', '--worker', json.dumps(cfg)],
+                         stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if out.returncode != 0:
+      print("config failed", cfg, file=sys.stderr)
+      failed.append(cfg)
+      continue
+    rows.append(json.loads(out.stdout.decode().strip().split('\n')[-1]))
+    print("%d configs done, last %.2f ms/step" % (len(rows), rows[-1]['step_ms']), file=sys.stderr)
+
+  if rows:
+    print_table(rows)
+  else:
+    print("no configs completed, %d failed" % len(failed), file=sys.stderr)
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump({'results': rows, 'failed': failed}, f, indent=2)
+  if not rows:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
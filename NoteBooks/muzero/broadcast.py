@@ -0,0 +1,131 @@
+import numpy as np
+from multiprocessing import shared_memory
+from muzero.npmodel import NumpyMuModel, numpy_params
+from muzero.shared import attach_shm, layout, views
+
+# learner -> actor weight broadcast through shared memory
+# the learner writes each version of the h/g/f weights as one flat float32 buffer into a free slot,
+# actors point a NumpyMuModel at the newest slot without copying and report the version they play with
+
+def model_params(m):
+  # a NumpyMuModel already holds its params, a MuModel gets exported
+  return m.params if isinstance(m, NumpyMuModel) else numpy_params(m)[1]
+
+class WeightPublisher():
+  def __init__(self, m, max_actors=16, nslots=None, name=None):
+    self.meta, params = (m.meta, m.params) if isinstance(m, NumpyMuModel) else numpy_params(m)
+    self.keys = [(k, params[k].shape) for k in sorted(params)]
+    self.size = sum(int(np.prod(shape)) for _, shape in self.keys)
+    # every actor can hold a different old version while the newest one is up and the next one is written
+    nslots = max_actors + 2 if nslots is None else nslots
+    if nslots < max_actors + 2:
+      raise ValueError("need at least max_actors + 2 = %d slots, got %d" % (max_actors + 2, nslots))
+    self.max_actors, self.nslots = max_actors, nslots
+    self.layout, size = weight_layout(self.size, max_actors, nslots)
+    self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    for k, v in views(self.shm.buf, self.layout).items():
+      setattr(self, k, v)
+    self.header[:] = 0
+    self.slot_version[:] = 0
+    self.actor_version[:] = 0
+
+  def subscriber(self, actor_id):
+    # picklable handle for an actor process
+    return WeightSubscriber(self.shm.name, self.meta, self.keys, self.max_actors, self.nslots, actor_id)
+
+  def _pick_slot(self):
+    # never the newest version or one an actor is still playing with
+    # (version 0 is an empty slot, or an actor that has not played yet)
+    busy = (set(self.actor_version.tolist()) | {int(self.header[0])}) - {0}
+    free = [s for s in range(self.nslots) if int(self.slot_version[s]) not in busy]
+    return free[0] if free else None
+
+  def publish(self, m):
+    params = model_params(m)
+    version = int(self.header[0]) + 1
+    while True:
+      s = self._pick_slot()
+      if s is None:
+        # can't happen with max_actors + 2 slots, but never change weights under an actor
+        return None
+      old = int(self.slot_version[s])
+      # mark the slot as being written, then check no actor grabbed it in the meantime
+      self.slot_version[s] = -1
+      if old == 0 or old not in self.actor_version:
+        break
+      self.slot_version[s] = old
+    flat = self.flat[s]
+    off = 0
+    for k, shape in self.keys:
+      n = int(np.prod(shape))
+      flat[off:off+n] = params[k].ravel()
+      off += n
+    self.slot_version[s] = version
+    self.header[1] = s
+    self.header[0] = version
+    return version
+
+  @property
+  def version(self):
+    return int(self.header[0])
+
+  def lag(self):
+    # versions behind the newest, per actor that has reported
+    v = self.actor_version.copy()
+    return {i: self.version - int(x) for i, x in enumerate(v) if x > 0}
+
+  def close(self):
+    for k in self.layout:
+      setattr(self, k, None)
+    self.shm.close()
+    self.shm.unlink()
+
+def weight_layout(size, max_actors, nslots):
+  return layout([
+    # newest version, slot holding it
+    ('header', (2,), np.int64),
+    ('slot_version', (nslots,), np.int64),
+    ('actor_version', (max_actors,), np.int64),
+    ('flat', (nslots, size), np.float32)])
+
+class WeightSubscriber():
+  def __init__(self, name, meta, keys, max_actors, nslots, actor_id):
+    self.name, self.meta, self.keys = name, meta, keys
+    self.max_actors, self.nslots, self.actor_id = max_actors, nslots, actor_id
+    self.shm = None
+    self.model = None
+    self.version = 0
+
+  def __reduce__(self):
+    # a fresh subscriber that attaches on its first refresh
+    return (WeightSubscriber, (self.name, self.meta, self.keys, self.max_actors, self.nslots, self.actor_id))
+
+  def _attach(self):
+    self.shm = attach_shm(self.name)
+    size = sum(int(np.prod(shape)) for _, shape in self.keys)
+    for k, v in views(self.shm.buf, weight_layout(size, self.max_actors, self.nslots)[0]).items():
+      setattr(self, k, v)
+
+  def refresh(self):
+    # call between moves, returns True if self.model now plays a new version
+    if self.shm is None:
+      self._attach()
+    while True:
+      version, s = int(self.header[0]), int(self.header[1])
+      if version == 0 or version == self.version:
+        return False
+      # claim it first so the publisher leaves the slot alone, then make sure it was not already being rewritten
+      self.actor_version[self.actor_id] = version
+      if int(self.slot_version[s]) == version:
+        break
+    flat, params, off = self.flat[s], {}, 0
+    for k, shape in self.keys:
+      n = int(np.prod(shape))
+      params[k] = flat[off:off+n].reshape(shape)
+      off += n
+    if self.model is None:
+      self.model = NumpyMuModel(self.meta, params)
+    else:
+      self.model.set_params(params)
+    self.version = version
+    return True
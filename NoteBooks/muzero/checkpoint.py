@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+# checkpoints that stay off the training critical path
+# save() copies the weights and optimizer state in memory, a background thread writes them out
+
+def optimizer_of(m):
+  if m._mu is None:
+    return None
+  return m.optimizer if m.engine == 'tf' else m._mu.optimizer
+
+def optimizer_variables(opt):
+  v = opt.variables
+  return list(v() if callable(v) else v)
+
+def model_variables(m):
+  return m.h.trainable_variables + m.g.trainable_variables + m.f.trainable_variables
+
+class Checkpointer():
+  def __init__(self, directory, keep=3):
+    self.directory = directory
+    self.keep = keep
+    os.makedirs(directory, exist_ok=True)
+    self.queue = queue.Queue()
+    self.error = None
+    self.thread = threading.Thread(target=self._work, daemon=True)
+    self.thread.start()
+
+  def save(self, m, step, replay_buffer=None):
+    # snapshot now, write later
+    arrays = {}
+    for i, w in enumerate(m.h.get_weights() + m.g.get_weights() + m.f.get_weights()):
+      arrays['w/%d' % i] = w
+    opt = optimizer_of(m)
+    if opt is not None:
+      for i, v in enumerate(optimizer_variables(opt)):
+        arrays['opt/%d' % i] = v.numpy()
+    meta = {'step': step, 'config': m.config(), 'engine': m.engine}
+    if replay_buffer is not None:
+      meta['replay'] = replay_buffer.counters()
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    if self.error is not None:
+      raise self.error
+    self.queue.put((step, arrays))
+
+  def _work(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        self.queue.task_done()
+        return
+      step, arrays = item
+      try:
+        path = os.path.join(self.directory, "ckpt-%010d.npz" % step)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+          np.savez(f, **arrays)
+        os.replace(tmp, path)
+        for old in self.checkpoints()[:-self.keep]:
+          os.remove(old)
+      except Exception as e:
+        self.error = e
+      self.queue.task_done()
+
+  def checkpoints(self):
+    return sorted(glob.glob(os.path.join(self.directory, "ckpt-*.npz")))
+
+  def wait(self):
+    # block until every queued checkpoint is on disk
+    self.queue.join()
+    if self.error is not None:
+      raise self.error
+
+  def close(self):
+    self.queue.put(None)
+    self.thread.join()
+    if self.error is not None:
+      raise self.error
+
+  def restore(self, m, replay_buffer=None, path=None):
+    # load the newest (or given) checkpoint into m, returns its step or None if there is none
+    if path is None:
+      ckpts = self.checkpoints()
+      if not ckpts:
+        return None
+      path = ckpts[-1]
+    with np.load(path) as f:
+      meta = json.loads(f['meta'].tobytes().decode())
+      nw = len([k for k in f.files if k.startswith('w/')])
+      no = len([k for k in f.files if k.startswith('opt/')])
+      weights = [f['w/%d' % i] for i in range(nw)]
+      opt_state = [f['opt/%d' % i] for i in range(no)]
+    nh, ng = len(m.h.get_weights()), len(m.g.get_weights())
+    m.h.set_weights(weights[:nh])
+    m.g.set_weights(weights[nh:nh+ng])
+    m.f.set_weights(weights[nh+ng:])
+    if opt_state:
+      m.build_training()
+      opt = optimizer_of(m)
+      if len(optimizer_variables(opt)) != len(opt_state):
+        # slots are created lazily, make them before assigning
+        opt.build(model_variables(m))
+      for v, x in zip(optimizer_variables(opt), opt_state):
+        v.assign(x)
+    if replay_buffer is not None and 'replay' in meta:
+      replay_buffer.load_counters(meta['replay'])
+    return meta['step']
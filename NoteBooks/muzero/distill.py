@@ -0,0 +1,48 @@
+import time
+import numpy as np
+from muzero.model import MuModel, batch_arrays, one_hot
+from muzero.quantize import normalize, parity_report
+
+# distill a trained MuModel into a narrower/shallower student for latency critical actors
+# the student is trained on the teacher's own K step unroll over replay positions:
+# values, rewards and (softmaxed) policies after h, then g along the replayed actions
+
+def teacher_targets(teacher, o, a):
+  # a is (B, K) action indexes with -1 padding, returns v, r (B, K+1) and p (B, K+1, a_dim)
+  s = teacher.ht(o)
+  p, v = teacher.ft(s)
+  vs, rs, ps = [v], [np.zeros_like(v)], [normalize(p)]
+  for k in range(a.shape[1]):
+    r, s = teacher.gt(s, a[:, k])
+    p, v = teacher.ft(s)
+    vs.append(v)
+    rs.append(r)
+    ps.append(normalize(p))
+  return np.stack(vs, 1), np.stack(rs, 1), np.stack(ps, 1)
+
+def distill(teacher, replay_buffer, layer_dim=32, layer_count=2, s_dim=None, steps=1000, bs=None, lr=0.001):
+  student = MuModel(teacher.o_dim, teacher.a_dim, s_dim=teacher.s_dim if s_dim is None else s_dim, K=teacher.K,
+                    lr=lr, with_policy=teacher.with_policy, layer_count=layer_count, layer_dim=layer_dim)
+  for _ in range(steps):
+    o, a, _, _, _ = batch_arrays(replay_buffer.sample_batch(bs))
+    v, r, p = teacher_targets(teacher, o, a)
+    student.train_on_arrays(o, one_hot(a, teacher.a_dim), v, r, p)
+  return student
+
+def act_latency(m, o, n=200):
+  # seconds for one ht + gt + ft, the cost of an MCTS root plus one simulation
+  st = time.perf_counter()
+  for _ in range(n):
+    m.ft(m.gt(m.ht(o), 0)[1])
+  return (time.perf_counter() - st) / n
+
+def distill_report(teacher, student, observations, actions=None):
+  # speedup of the student against its agreement with the teacher on held-out observations
+  # teacher/student can be MuModels or their numpy exports
+  ret = parity_report(teacher, student, observations, actions)
+  # the student learns its own hidden state space, only its outputs are comparable
+  ret.pop('state_max_abs', None)
+  ret['teacher_us'] = 1e6 * act_latency(teacher, observations[0])
+  ret['student_us'] = 1e6 * act_latency(student, observations[0])
+  ret['speedup'] = ret['teacher_us'] / ret['student_us']
+  return ret
@@ -1,4 +1,5 @@
 import random
+import numpy as np
 
 # little game: basically put in the state
 # if you can't play little game, you are idiot
@@ -32,3 +33,32 @@ class Follower():
     self.state = [self.n,random.randint(0,1)]
     return self.state, rew, self.done, None
   
+
+# N Follower episodes stepped at once as numpy arrays
+# finished episodes reset themselves, their last observation is in info['final_observation']
+class VecFollower():
+  def __init__(self, num_envs, seed=None):
+    self.num_envs = num_envs
+    self.rng = np.random.default_rng(seed)
+    self.reset()
+
+  def reset(self):
+    self.n = np.zeros(self.num_envs, dtype=np.int64)
+    self.target = self.rng.integers(0, 2, size=self.num_envs)
+    return self.observation()
+
+  def observation(self):
+    return np.stack([self.n, self.target], axis=1)
+
+  observation_space = Follower.observation_space
+  action_space = Follower.action_space
+
+  def step(self, acts):
+    rew = (np.asarray(acts) == self.target).astype(np.float64)
+    self.n += 1
+    done = self.n == 3
+    self.target = self.rng.integers(0, 2, size=self.num_envs)
+    info = {'final_observation': self.observation()[done]}
+    self.n[done] = 0
+    self.target[done] = self.rng.integers(0, 2, size=int(done.sum()))
+    return self.observation(), rew, done, info
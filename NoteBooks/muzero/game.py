@@ -1,83 +1,299 @@
 import numpy as np
 import random
+import threading
+import time
+import zlib
+from muzero.stats import ReplayStats
+
+# observation codecs, (compress, decompress) on raw bytes
+CODECS = {'zlib': (zlib.compress, zlib.decompress)}
+try:
+  import lz4.frame
+  CODECS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+  pass
+
+def unroll_targets(actions, values, rewards, policies, idx, start, end):
+  # targets of a K step unroll from flat per-position columns, shared by Game and the array replay buffers
+  # idx (B, K+1) rows from each sampled position on, start and end (B, 1) the rows of its game
+  # returns actions (B, K) with -1 padding, values and last rewards (B, K+1), policies (B, K+1, a_dim)
+  K = idx.shape[1] - 1
+  valid = idx < end
+  cidx = np.minimum(idx, end - 1)
+  actions = np.where(valid[:, :K], actions[cidx[:, :K]], -1)
+  values = np.where(valid, values[cidx], 0)
+  rewards = np.where((idx > start) & (idx <= end), rewards[np.clip(idx - 1, start, end - 1)], 0)
+  # no policy, what does cross entropy do? hopefully not learn
+  policies = np.where(valid[:, :, None], policies[cidx], 0)
+  return actions, values, rewards, policies
+
+def batch_list(obs, actions, values, rewards, policies):
+  # sample_arrays output in the ReplayBuffer.sample_batch format
+  return [(obs[b], actions[b], list(zip(values[b], rewards[b], policies[b]))) for b in range(len(obs))]
 
 class Game():
-  def __init__(self, env, discount=0.95):
+  def __init__(self, env, discount=0.95, obs_dtype=None):
     self.env = env
-    self.observations = []
-    self.history = []
-    self.rewards = []
-    self.policies = []
+    self.obs_dtype = obs_dtype
+    self.obs_chunks = None
     self.discount = discount
     self.done = False
     self.observation = env.reset()
     self.total_reward = 0
 
+    # trajectory storage, amortized doubling numpy buffers
+    # allocated on the first apply once shapes and dtypes are known
+    self.n = 0
+    self._obs = self._actions = self._rewards = self._policies = None
+    self._values = None
+
+  @classmethod
+  def from_arrays(cls, observations, actions, rewards, policies, discount=0.95, env=None):
+    # a finished game from stored trajectory columns, see muzero.trajectory
+    game = cls.__new__(cls)
+    game.env = env
+    game.obs_chunks = None
+    game.discount = discount
+    game.done = True
+    game.observation = None
+    game._obs = np.array(observations)
+    game.obs_dtype = game._obs.dtype
+    game._actions = np.array(actions, dtype=np.int64)
+    game._rewards = np.array(rewards, dtype=np.float64)
+    game._policies = np.array(policies, dtype=np.float64)
+    game.n = len(game._actions)
+    game.total_reward = float(game._rewards.sum())
+    game._values = None
+    return game
+
+  # zero-copy views of the first n steps
+  @property
+  def observations(self):
+    if self.obs_chunks is not None:
+      return np.concatenate([self._chunk(c) for c in range(len(self.obs_chunks))])
+    return self._obs[:self.n] if self._obs is not None else np.zeros((0,))
+
+  @property
+  def history(self):
+    return self._actions[:self.n] if self._actions is not None else np.zeros((0,), np.int64)
+
+  @property
+  def rewards(self):
+    return self._rewards[:self.n] if self._rewards is not None else np.zeros((0,))
+
+  @property
+  def policies(self):
+    return self._policies[:self.n] if self._policies is not None else np.zeros((0, 0))
+
+  def _alloc(self, o, p):
+    a_dim = len(p) if p is not None else self.env.action_space.n
+    cap = 16
+    self._obs = np.empty((cap,) + o.shape, dtype=o.dtype)
+    self._actions = np.empty((cap,), dtype=np.int64)
+    self._rewards = np.empty((cap,), dtype=np.float64)
+    self._policies = np.zeros((cap, a_dim), dtype=np.float64)
+
+  def _grow(self):
+    def grow(x):
+      ret = np.zeros((2*x.shape[0],) + x.shape[1:], dtype=x.dtype)
+      ret[:x.shape[0]] = x
+      return ret
+    self._obs, self._actions, self._rewards, self._policies = \
+      grow(self._obs), grow(self._actions), grow(self._rewards), grow(self._policies)
+
   def terminal(self):
     return self.done
 
   def apply(self, a_1, p=None):
-    self.observations.append(np.copy(self.observation))
+    o = np.asarray(self.observation, dtype=self.obs_dtype)
+    if self._obs is None:
+      self._alloc(o, p)
+    elif self.n == self._obs.shape[0]:
+      self._grow()
+    self._obs[self.n] = o
     self.observation, r_1, done, _ = self.env.step(a_1)
 
-    self.history.append(a_1)
-    self.rewards.append(r_1)
+    self._actions[self.n] = a_1
+    self._rewards[self.n] = r_1
     self.total_reward += r_1
-    self.policies.append(p)
+    if p is not None:
+      self._policies[self.n] = p
+    self.n += 1
+    self._values = None
 
     self.done = done
 
   def act_with_policy(self, policy):
-    act = np.random.choice(list(range(len(policy))), p=policy)
+    act = np.random.choice(len(policy), p=policy)
     self.apply(act, policy)
 
+  def compress(self, codec='zlib', chunk_size=32, obs_dtype=None):
+    # trim the growth slack and pack the observations into compressed chunks of chunk_size steps
+    # make_image decompresses the chunk it needs at sample time
+    if self._obs is None or self.obs_chunks is not None:
+      return
+    self._actions, self._rewards, self._policies = self.history.copy(), self.rewards.copy(), self.policies.copy()
+    obs = self.observations
+    self.raw_nbytes = obs.nbytes
+    obs = obs.astype(obs_dtype) if obs_dtype is not None else obs.copy()
+    self.obs_shape, self.obs_dtype = obs.shape[1:], obs.dtype
+    self.obs_codec, self.obs_chunk_size = codec, chunk_size
+    if codec is None:
+      self._obs = obs
+      self.stored_nbytes = obs.nbytes
+      return
+    compress, _ = CODECS[codec]
+    self.obs_chunks = [compress(obs[i:i+chunk_size].tobytes()) for i in range(0, len(obs), chunk_size)]
+    self._obs = None
+    self.stored_nbytes = sum(len(c) for c in self.obs_chunks)
+
+  def _chunk(self, c):
+    _, decompress = CODECS[self.obs_codec]
+    chunk = np.frombuffer(decompress(self.obs_chunks[c]), dtype=self.obs_dtype)
+    return chunk.reshape((-1,) + self.obs_shape)
+
   def make_image(self, i):
-    return self.observations[i]
+    if self.obs_chunks is None:
+      return self._obs[i]
+    return self._chunk(i // self.obs_chunk_size)[i % self.obs_chunk_size]
 
-  def make_target(self, state_index, num_unroll_steps):
-    targets = []
-    for current_index in range(state_index, state_index + num_unroll_steps + 1):
+  def values(self):
+    # discounted return from every step, cached until the next apply
+    if self._values is None:
+      self._values = np.zeros(self.n)
       value = 0
-      for i, reward in enumerate(self.rewards[current_index:]):
-        value += reward * self.discount**i
-        
-      if current_index > 0 and current_index <= len(self.rewards):
-        last_reward = self.rewards[current_index - 1]
-      else:
-        last_reward = 0
+      for i in reversed(range(self.n)):
+        value = self._rewards[i] + self.discount * value
+        self._values[i] = value
+    return self._values
 
-      if current_index < len(self.policies):
-        targets.append((value, last_reward, self.policies[current_index]))
-      else:
-        # no policy, what does cross entropy do? hopefully not learn
-        targets.append((0, last_reward, np.array([0]*len(self.policies[0]))))
-    return targets 
+  def make_target_arrays(self, state_index, num_unroll_steps):
+    # value, last_reward and policy targets as (K+1,) (K+1,) (K+1, a_dim) arrays
+    idx = np.arange(state_index, state_index + num_unroll_steps + 1)[None]
+    _, values, last_rewards, policies = unroll_targets(self._actions, self.values(), self._rewards, self._policies,
+                                                       idx, 0, self.n)
+    return values[0], last_rewards[0], policies[0]
+
+  def make_target(self, state_index, num_unroll_steps):
+    return list(zip(*self.make_target_arrays(state_index, num_unroll_steps)))
 
 class ReplayBuffer():
-  def __init__(self, window_size, batch_size, num_unroll_steps):
+  def __init__(self, window_size, batch_size, num_unroll_steps, obs_dtype=None, compress=None, chunk_size=32, stats=False,
+               uniform_positions=True):
     self.window_size = window_size
     self.batch_size = batch_size
     self.num_unroll_steps = num_unroll_steps
     self.buffer = []
+    self.games_saved = 0
+    self.positions_saved = 0
+
+    # flat index over every stored position, a ring of (game serial, position) pairs
+    # games enter at the tail and leave from the head, so the live positions stay contiguous
+    self.uniform_positions = uniform_positions
+    self._flat_game = np.zeros(1024, dtype=np.int64)
+    self._flat_pos = np.zeros(1024, dtype=np.int64)
+    self._flat_head = 0
+    self._flat_size = 0
+    # guards self.buffer against save_game while sampling from another thread
+    self.lock = threading.Lock()
+
+    # observation storage, compress is a key of CODECS or None
+    if compress is not None and compress not in CODECS:
+      raise ValueError("unknown or unavailable codec %r, available: %s (lz4 needs the lz4 package)" %
+                       (compress, ', '.join(sorted(CODECS))))
+    self.obs_dtype = obs_dtype
+    self.compress = compress
+    self.chunk_size = chunk_size
+    self.raw_nbytes = 0
+    self.stored_nbytes = 0
+
+    # optional ingest/sampling instrumentation, see muzero.stats
+    self.stats = ReplayStats() if stats else None
 
   def save_game(self, game):
-    if len(self.buffer) > self.window_size:
-      self.buffer.pop(0)
-    self.buffer.append(game)
+    game.compress(self.compress, self.chunk_size, self.obs_dtype)
+    with self.lock:
+      if len(self.buffer) > self.window_size:
+        self._evict(self.buffer.pop(0))
+      if self.stats is not None:
+        self.stats.on_save(game)
+      self._index(self.games_saved, game.n)
+      self.buffer.append(game)
+      self.games_saved += 1
+      self.positions_saved += game.n
+    self.raw_nbytes += getattr(game, 'raw_nbytes', 0)
+    self.stored_nbytes += getattr(game, 'stored_nbytes', 0)
+
+  def _index(self, serial, n):
+    cap = len(self._flat_game)
+    if self._flat_size + n > cap:
+      # unroll the ring into a bigger one
+      ncap = max(2*cap, self._flat_size + n)
+      live = (self._flat_head + np.arange(self._flat_size)) % cap
+      self._flat_game = np.concatenate([self._flat_game[live], np.zeros(ncap - self._flat_size, dtype=np.int64)])
+      self._flat_pos = np.concatenate([self._flat_pos[live], np.zeros(ncap - self._flat_size, dtype=np.int64)])
+      self._flat_head, cap = 0, ncap
+    idx = (self._flat_head + self._flat_size + np.arange(n)) % cap
+    self._flat_game[idx] = serial
+    self._flat_pos[idx] = np.arange(n)
+    self._flat_size += n
+
+  def _evict(self, game):
+    self._flat_head = (self._flat_head + game.n) % len(self._flat_game)
+    self._flat_size -= game.n
+    if self.stats is not None:
+      self.stats.on_evict(game)
+    self.raw_nbytes -= getattr(game, 'raw_nbytes', 0)
+    self.stored_nbytes -= getattr(game, 'stored_nbytes', 0)
+
+  def counters(self):
+    # what a resumed run needs to carry on counting, see muzero.checkpoint
+    ret = {'games_saved': self.games_saved, 'positions_saved': self.positions_saved}
+    if self.stats is not None:
+      ret['stats'] = {k: getattr(self.stats, k) for k in ('games_saved', 'positions_saved', 'batches', 'samples')}
+    return ret
+
+  def load_counters(self, counters):
+    if self.buffer:
+      raise ValueError("load_counters needs an empty buffer")
+    self.games_saved = counters['games_saved']
+    self.positions_saved = counters['positions_saved']
+    if self.stats is not None and 'stats' in counters:
+      for k, v in counters['stats'].items():
+        setattr(self.stats, k, v)
+
+  def compression_stats(self):
+    return {'raw_bytes': self.raw_nbytes, 'stored_bytes': self.stored_nbytes,
+            'ratio': self.raw_nbytes / self.stored_nbytes if self.stored_nbytes else 1.0}
 
   def sample_batch(self, bs=None):
-    games = [self.sample_game() for _ in range(self.batch_size if bs is None else bs)]
-    game_pos = [(g, self.sample_position(g)) for g in games]
+    st = time.perf_counter()
+    bs = self.batch_size if bs is None else bs
+    with self.lock:
+      if self.uniform_positions:
+        gidx, pos = self.sample_positions(bs)
+        game_pos = [(self.buffer[g], i) for g, i in zip(gidx.tolist(), pos.tolist())]
+      else:
+        game_pos = [(g, self.sample_position(g)) for g in [self.sample_game() for _ in range(bs)]]
     def xtend(g,x,s):
       # pick the last (fake) action
-      while len(x) < s:
-        #x.append(random.randint(0, len(g.policies[0])-1))
-        #x.append(len(g.policies[0])-1)
-        x.append(-1)
-      return x
-    return [(g.make_image(i), xtend(g,g.history[i:i + self.num_unroll_steps], self.num_unroll_steps),
-             g.make_target(i, self.num_unroll_steps))
-             for (g, i) in game_pos]
+      ret = np.full(s, -1, dtype=np.int64)
+      ret[:len(x)] = x
+      return ret
+    ret = [(g.make_image(i), xtend(g,g.history[i:i + self.num_unroll_steps], self.num_unroll_steps),
+            g.make_target(i, self.num_unroll_steps))
+            for (g, i) in game_pos]
+    if self.stats is not None:
+      with self.lock:
+        self.stats.on_sample(game_pos, time.perf_counter() - st)
+    return ret
+
+  def sample_positions(self, bs):
+    # one vectorized draw, uniform over positions, O(bs) however many games are stored
+    # returns indexes into self.buffer and positions within those games
+    k = (self._flat_head + np.random.randint(0, self._flat_size, size=bs)) % len(self._flat_game)
+    first = self.games_saved - len(self.buffer)
+    return self._flat_game[k] - first, self._flat_pos[k]
 
   def sample_game(self):
     return random.choice(self.buffer)
@@ -73,6 +73,47 @@ def select_child(node: Node, min_max_stats=None):
   _, action, child = random.choice(list(filter(lambda x: x[0] == smax, out)))
   return action, child
 
+def expand(node, policy):
+  # create all the children of node, with the policy as prior
+  for i in range(policy.shape[0]):
+    node.children[i] = Node(policy[i])
+    node.children[i].to_play = -node.to_play
+
+def add_exploration_noise(root):
+  actions = list(root.children.keys())
+  noise = np.random.dirichlet([root_dirichlet_alpha] * len(actions))
+  frac = root_exploration_fraction
+  for a, n in zip(actions, noise):
+    root.children[a].prior = root.children[a].prior * (1 - frac) + n * frac
+
+def select_leaf(root):
+  # traverse down the tree according to the ucb_score
+  history = []
+  node = root
+  search_path = [node]
+  while node.expanded():
+    #action, node = select_child(node, min_max_stats)
+    action, node = select_child(node)
+    history.append(action)
+    search_path.append(node)
+  return history, search_path
+
+def backpropagate(search_path, value, to_play, minimax=True):
+  for bnode in reversed(search_path):
+    if minimax:
+      bnode.value_sum += value if to_play == bnode.to_play else -value
+    else:
+      bnode.value_sum += value
+    bnode.visit_count += 1
+    #min_max_stats.update(node.value())
+    value = bnode.reward + discount * value
+
+def visit_policy(root):
+  visit_counts = [(action, child.visit_count) for action, child in root.children.items()]
+  visit_counts = [x[1] for x in sorted(visit_counts)]
+  av = np.array(visit_counts).astype(np.float64)
+  return softmax(av)
+
 def mcts_search(m, observation, num_simulations=10, minimax=True):
   # init the root node
   root = Node(0)
@@ -82,60 +123,60 @@ def mcts_search(m, observation, num_simulations=10, minimax=True):
   policy, value = m.ft(root.hidden_state)
 
   # expand the children of the root node
-  for i in range(policy.shape[0]):
-    root.children[i] = Node(policy[i])
-    root.children[i].to_play = -root.to_play
+  expand(root, policy)
 
   # add exploration noise at the root
-  actions = list(root.children.keys())
-  noise = np.random.dirichlet([root_dirichlet_alpha] * len(actions))
-  frac = root_exploration_fraction
-  for a, n in zip(actions, noise):
-    root.children[a].prior = root.children[a].prior * (1 - frac) + n * frac
+  add_exploration_noise(root)
 
   # run_mcts
   #min_max_stats = MinMaxStats()
   for _ in range(num_simulations):
-    history = []
-    node = root
-    search_path = [node]
-
-    # traverse down the tree according to the ucb_score 
-    while node.expanded():
-      #action, node = select_child(node, min_max_stats)
-      action, node = select_child(node)
-      history.append(action)
-      search_path.append(node)
+    history, search_path = select_leaf(root)
 
     # now we are at a leaf which is not "expanded", run the dynamics model
-    parent = search_path[-2]
+    node, parent = search_path[-1], search_path[-2]
     node.reward, node.hidden_state = m.gt(parent.hidden_state, history[-1])
 
     # use the model to estimate the policy and value, use policy as prior
     policy, value = m.ft(node.hidden_state)
     #print(history, value)
-
-    # create all the children of the newly expanded node
-    for i in range(policy.shape[0]):
-      node.children[i] = Node(prior=policy[i])
-      node.children[i].to_play = -node.to_play
+    expand(node, policy)
 
     # update the state with "backpropagate"
-    for bnode in reversed(search_path):
-      if minimax:
-        bnode.value_sum += value if root.to_play == bnode.to_play else -value
-      else:
-        bnode.value_sum += value
-      bnode.visit_count += 1
-      #min_max_stats.update(node.value())
-      value = bnode.reward + discount * value
+    backpropagate(search_path, value, root.to_play, minimax)
 
   # output the final policy
-  visit_counts = [(action, child.visit_count) for action, child in root.children.items()]
-  visit_counts = [x[1] for x in sorted(visit_counts)]
-  av = np.array(visit_counts).astype(np.float64)
-  policy = softmax(av)
-  return policy, root
+  return visit_policy(root), root
+
+def mcts_search_batch(m, observations, num_simulations=10, minimax=True):
+  # mcts_search over many observations in lockstep, one tree each
+  # every simulation picks a leaf in every tree and expands them all with one batched gt and one batched ft
+  # returns a list of (policy, root)
+  hidden_states = m.ht(np.asarray(observations))
+  policies, _ = m.ft(hidden_states)
+  roots = []
+  for i, observation in enumerate(observations):
+    root = Node(0)
+    root.hidden_state = hidden_states[i]
+    if minimax:
+      root.to_play = observation[-1]
+    expand(root, policies[i])
+    add_exploration_noise(root)
+    roots.append(root)
+
+  for _ in range(num_simulations):
+    leaves = [select_leaf(root) for root in roots]
+    parents = np.array([search_path[-2].hidden_state for _, search_path in leaves])
+    actions = np.array([history[-1] for history, _ in leaves])
+    rewards, hidden_states = m.gt(parents, actions)
+    policies, values = m.ft(hidden_states)
+    for i, (_, search_path) in enumerate(leaves):
+      node = search_path[-1]
+      node.reward, node.hidden_state = rewards[i], hidden_states[i]
+      expand(node, policies[i])
+      backpropagate(search_path, values[i], roots[i].to_play, minimax)
+
+  return [(visit_policy(root), root) for root in roots]
 
 def print_tree(x, hist=[]):
   if x.visit_count != 0:
@@ -185,13 +226,15 @@ def naive_search(m, o_0, debug=False, T=1):
   policy = softmax(av)
   return policy
 
-def get_values(m, o_0):
-	hidden_state = m.ht(o_0)
-	vs = []
-	for n in range(m.a_dim):
-		_, ht2 = m.gt(hidden_state, n)
-		_, v = m.ft(ht2)
-		vs.append(v)
-	return vs
-
+def action_values(m, observations):
+  # probe every action of every observation with one batched gt and one batched ft
+  # returns the (P, a_dim) values after each action and the (P, a_dim) rewards for taking it
+  hidden_states = m.ht(np.asarray(observations))
+  P, A = len(hidden_states), m.a_dim
+  rewards, next_states = m.gt(np.repeat(hidden_states, A, axis=0), np.tile(np.arange(A), P))
+  _, values = m.ft(next_states)
+  return np.reshape(values, (P, A)), np.reshape(rewards, (P, A))
 
+def get_values(m, o_0):
+  values, _ = action_values(m, [o_0])
+  return list(values[0])
@@ -1,3 +1,9 @@
+import collections
+import hashlib
+import json
+import os
+import shutil
+import time
 import tensorflow as tf
 import numpy as np
 from tensorflow.keras.models import Model
@@ -10,44 +16,85 @@ def to_one_hot(x,n):
     ret[x] = 1.0
   return ret
 
+def one_hot(a, n, dtype=np.float32):
+  # vectorized to_one_hot, rows of eye(n+1, n) so the -1 padding action is a zero row
+  return np.eye(n + 1, n, dtype=dtype)[a]
+
 def bstack(bb):
-  ret = [[x] for x in bb[0]]
-  for i in range(1, len(bb)):
-    for j in range(len(bb[i])):
-      ret[j].append(bb[i][j])
-  return [np.array(x) for x in ret]
+  # transpose a batch of per-sample lists into per-field arrays
+  return [np.array(x) for x in zip(*bb)]
 
-def reformat_batch(batch, a_dim, remove_policy=False):
-  X,Y = [], []
-  for o,a,outs in batch:
-    x = [o] + [to_one_hot(x, a_dim) for x in a]
-    y = []
-    for ll in [list(x) for x in outs]:
-      y += ll
-    X.append(x)
-    Y.append(y)
-  X = bstack(X)
-  Y = bstack(Y)
+def reformat_arrays(o, a, v, r, p, a_dim, remove_policy=False):
+  # o (B, ...), a (B, K) with -1 padding, v and r (B, K+1), p (B, K+1, a_dim)
+  X = [o] + list(one_hot(a, a_dim, np.float64).swapaxes(0, 1))
   if remove_policy:
-    nY = [Y[0]]
-    for i in range(3, len(Y), 3):
-      nY.append(Y[i])
-      nY.append(Y[i+1])
-    Y = nY
+    Y = [v[:, 0]]
+    for k in range(1, v.shape[1]):
+      Y += [v[:, k], r[:, k]]
   else:
-    Y = [Y[0]] + Y[2:]
+    Y = [v[:, 0], p[:, 0]]
+    for k in range(1, v.shape[1]):
+      Y += [v[:, k], r[:, k], p[:, k]]
   return X,Y
 
+def batch_arrays(batch):
+  # a sample_batch list as o, a, v, r, p arrays
+  o, a, outs = zip(*batch)
+  v, r, p = zip(*[zip(*x) for x in outs])
+  return np.array(o), np.array(a), np.array(v), np.array(r), np.array(p)
+
+def train_arrays(batch, a_dim):
+  # a sample_batch list as the float32 o, one-hot a, v, r, p that MuModel.train_on_arrays takes
+  o, a, v, r, p = batch_arrays(batch)
+  f32 = lambda x: x.astype(np.float32)
+  return f32(o), one_hot(a, a_dim), f32(v), f32(r), f32(p)
+
+def unformat_arrays(X, Y, a_dim, remove_policy=False):
+  # inverse of reformat_arrays, actions stay one-hot as (B, K, a_dim)
+  o, a = X[0], np.stack(X[1:], axis=1)
+  if remove_policy:
+    v = np.stack([Y[0]] + Y[1::2], axis=1)
+    r = np.stack([np.zeros_like(Y[0])] + Y[2::2], axis=1)
+    p = np.zeros(v.shape + (a_dim,))
+  else:
+    v = np.stack([Y[0]] + Y[2::3], axis=1)
+    r = np.stack([np.zeros_like(Y[0])] + Y[3::3], axis=1)
+    p = np.stack([Y[1]] + Y[4::3], axis=1)
+  return o, a, v, r, p
+
+def reformat_batch(batch, a_dim, remove_policy=False):
+  return reformat_arrays(*batch_arrays(batch), a_dim, remove_policy)
+
+def inference_path(cache_dir, config):
+  key = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+  return os.path.join(cache_dir, "mu_inference_%s" % key)
+
 class MuModel():
   LAYER_COUNT = 4
   LAYER_DIM = 128
   BN = False
 
-  def __init__(self, o_dim, a_dim, s_dim=8, K=5, lr=0.001, with_policy=True):
+  def __init__(self, o_dim, a_dim, s_dim=8, K=5, lr=0.001, with_policy=True, engine='tf',
+               layer_count=None, layer_dim=None, telemetry=None, loss_history=10000):
+    # per instance overrides of the class defaults
+    if layer_count is not None:
+      self.LAYER_COUNT = layer_count
+    if layer_dim is not None:
+      self.LAYER_DIM = layer_dim
     self.o_dim = o_dim
+    self.o_shape = tuple(o_dim) if hasattr(o_dim, '__len__') else (o_dim,)
     self.a_dim = a_dim
-    self.losses = []
+    self.s_dim = s_dim
+    self.K = K
+    self.lr = lr
+    # the last loss_history loss vectors, long running stats go to telemetry (a muzero.stats.TrainTelemetry)
+    self.losses = collections.deque(maxlen=loss_history)
     self.with_policy = with_policy
+    self.telemetry = telemetry
+    if telemetry is not None:
+      telemetry.set_names(self.loss_names())
+    # training engine, 'tf' is a compiled custom train step, 'keras' is mu.train_on_batch
+    self.engine = engine
 
     # h: representation function
     # s_0 = h(o_1...o_t)
@@ -87,30 +134,203 @@ class MuModel():
     else:
       self.f = Model(s_k, v_k, name="f")
 
-    # combine them all
-    self.create_mu(K, lr)
+    # combine them all, deferred until the first training call or use of self.mu
+    self._mu = None
+
+    # low latency inference
+    self.trace_inference()
+
+  @property
+  def mu(self):
+    self.build_training()
+    return self._mu
+
+  def build_training(self):
+    if self._mu is None:
+      if self.h is None:
+        raise RuntimeError("inference only MuModel, build a full MuModel to train")
+      self.create_mu(self.K, self.lr)
+
+  def loss_names(self):
+    # the order of the loss vectors train_on_* return
+    names = ['total', 'v_0'] + (['p_0'] if self.with_policy else [])
+    for k in range(1, self.K + 1):
+      names += ['v_%d' % k, 'r_%d' % k] + (['p_%d' % k] if self.with_policy else [])
+    return names
+
+  def record(self, l, dt, batch_size):
+    self.losses.append(l)
+    if self.telemetry is not None:
+      self.telemetry.step(l, dt, batch_size)
+
+  def config(self):
+    return {'o_shape': list(self.o_shape), 'a_dim': self.a_dim, 's_dim': self.s_dim, 'with_policy': self.with_policy,
+            'layer_count': self.LAYER_COUNT, 'layer_dim': self.LAYER_DIM, 'bn': self.BN, 'tf': tf.__version__}
+
+  def save_inference(self, cache_dir):
+    # save the traced h/g/f functions and their weights, keyed by the model config
+    path = inference_path(cache_dir, self.config())
+    spec = lambda *shape: tf.TensorSpec((None,) + shape, tf.float32)
+    module = tf.Module()
+    module.weights = self.h.weights + self.g.weights + self.f.weights
+    module.ht = tf.function(lambda o: self.h(o, training=False), input_signature=[spec(*self.o_shape)])
+    module.gt = tf.function(lambda s, a: self.g([s, a], training=False), input_signature=[spec(self.s_dim), spec(self.a_dim)])
+    module.ft = tf.function(lambda s: self.f(s, training=False), input_signature=[spec(self.s_dim)])
+    tmp = path + ".tmp%d" % os.getpid()
+    tf.saved_model.save(module, tmp)
+    if os.path.exists(path):
+      shutil.rmtree(path)
+    os.replace(tmp, path)
+    return path
 
+  @classmethod
+  def load_inference(cls, cache_dir, o_dim, a_dim, s_dim=8, with_policy=True, layer_count=None, layer_dim=None):
+    # an inference only MuModel from save_inference, no keras models and no retracing
+    # returns None on a cache miss
+    m = cls.__new__(cls)
+    if layer_count is not None:
+      m.LAYER_COUNT = layer_count
+    if layer_dim is not None:
+      m.LAYER_DIM = layer_dim
+    m.o_dim, m.a_dim, m.s_dim, m.with_policy = o_dim, a_dim, s_dim, with_policy
+    m.o_shape = tuple(o_dim) if hasattr(o_dim, '__len__') else (o_dim,)
+    path = inference_path(cache_dir, m.config())
+    if not os.path.exists(path):
+      return None
+    m.h = m.g = m.f = m._mu = None
+    m.K = m.lr = m.telemetry = None
+    m.engine = 'tf'
+    m.losses = collections.deque(maxlen=1)
+    m._inference = tf.saved_model.load(path)
+    m._h_fn, m._g_fn, m._f_fn = m._inference.ht, m._inference.gt, m._inference.ft
+    return m
+
+  def set_inference_weights(self, weights):
+    # h, g then f weights, as in h.get_weights() + g.get_weights() + f.get_weights()
+    for v, w in zip(self._inference.weights, weights):
+      v.assign(w)
+
+  def trace_inference(self):
+    # concrete functions with fixed input signatures, skips the per call overhead of predict
+    spec = lambda *shape: tf.TensorSpec((None,) + shape, tf.float32)
+    self._h_fn = tf.function(lambda o: self.h(o, training=False)).get_concrete_function(spec(*self.o_shape))
+    self._g_fn = tf.function(lambda s, a: self.g([s, a], training=False)).get_concrete_function(
+      spec(self.s_dim), spec(self.a_dim))
+    self._f_fn = tf.function(lambda s: self.f(s, training=False)).get_concrete_function(spec(self.s_dim))
+
+  # ht, gt and ft take a single sample or a batch, batches return batched outputs
   def ht(self, o_0):
-    return self.h.predict(np.array(o_0)[None])[0]
+    o_0 = np.asarray(o_0, dtype=np.float32)
+    single = o_0.ndim == len(self.o_shape)
+    s_0 = self._h_fn(o_0[None] if single else o_0).numpy()
+    return s_0[0] if single else s_0
 
   def gt(self, s_km1, a_k):
-    r_k, s_k = self.g.predict([s_km1[None], to_one_hot(a_k, self.a_dim)[None]])
-    return r_k[0][0], s_k[0]
+    s_km1 = np.asarray(s_km1, dtype=np.float32)
+    single = s_km1.ndim == 1
+    a_k = one_hot(np.asarray(a_k), self.a_dim)
+    r_k, s_k = self._g_fn(s_km1[None] if single else s_km1, a_k[None] if single else a_k)
+    r_k, s_k = r_k.numpy()[:, 0], s_k.numpy()
+    return (r_k[0], s_k[0]) if single else (r_k, s_k)
 
   def ft(self, s_k):
+    s_k = np.asarray(s_k, dtype=np.float32)
+    single = s_k.ndim == 1
+    out = self._f_fn(s_k[None] if single else s_k)
     if self.with_policy:
-      p_k, v_k = self.f.predict(s_k[None])
-      return np.exp(p_k[0]), v_k[0][0]
+      p_k, v_k = np.exp(out[0].numpy()), out[1].numpy()[:, 0]
     else:
-      v_k = self.f.predict(s_k[None])
-      return np.array([1/self.a_dim]*self.a_dim), v_k[0][0]
+      v_k = out.numpy()[:, 0]
+      p_k = np.full((len(v_k), self.a_dim), 1/self.a_dim)
+    return (p_k[0], v_k[0]) if single else (p_k, v_k)
 
   def train_on_batch(self, batch):
+    if self.engine == 'tf':
+      return self.train_on_arrays(*train_arrays(batch, self.a_dim))
     X,Y = reformat_batch(batch, self.a_dim, not self.with_policy)
-    l = self.mu.train_on_batch(X,Y)
-    self.losses.append(l)
+    return self.train_on_reformatted(X, Y)
+
+  def train_on_reformatted(self, X, Y):
+    # X,Y as built by reformat_batch, e.g. from a muzero.prefetch.Prefetcher with engine='keras'
+    if self.engine == 'tf':
+      return self.train_on_arrays(*unformat_arrays(X, Y, self.a_dim, not self.with_policy))
+    mu = self.mu
+    st = time.perf_counter()
+    l = mu.train_on_batch(X,Y)
+    self.record(l, time.perf_counter() - st, len(X[0]))
     return l
 
+  def train_on_arrays(self, o, a, v, r, p):
+    # a is one-hot (B, K, a_dim), returns [total] + per-head losses in mu output order like the keras engine
+    self.build_training()
+    f32 = lambda x: tf.convert_to_tensor(np.asarray(x, dtype=np.float32))
+    st = time.perf_counter()
+    l = self._train_step(f32(o), f32(a), f32(v), f32(r), f32(p)).numpy().tolist()
+    self.record(l, time.perf_counter() - st, len(o))
+    return l
+
+  def unroll_losses(self, o, a, v, r, p):
+    # per-head losses [v_0, (p_0), v_1, r_1, (p_1), ...] of the K step unroll
+    mse = lambda y, x: tf.reduce_mean(tf.square(x[:, 0] - y))
+    losses = []
+    s_k = self.h(o, training=True)
+    for k in range(self.K + 1):
+      if k > 0:
+        r_k, s_k = self.g([s_k, a[:, k-1]], training=True)
+      if self.with_policy:
+        p_k, v_k = self.f(s_k, training=True)
+      else:
+        v_k = self.f(s_k, training=True)
+      losses.append(mse(v[:, k], v_k))
+      if k > 0:
+        losses.append(mse(r[:, k], r_k))
+      if self.with_policy:
+        losses.append(tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(p[:, k], p_k)))
+    return losses
+
+  def create_train_step(self, lr):
+    self.optimizer = Adam(lr)
+    variables = self.h.trainable_variables + self.g.trainable_variables + self.f.trainable_variables
+    spec = lambda *shape: tf.TensorSpec((None,) + shape, tf.float32)
+    K, A = self.K, self.a_dim
+
+    @tf.function(input_signature=[spec(*self.o_shape), spec(K, A), spec(K+1), spec(K+1), spec(K+1, A)])
+    def train_step(o, a, v, r, p):
+      with tf.GradientTape() as tape:
+        losses = self.unroll_losses(o, a, v, r, p)
+        total = tf.add_n(losses)
+      grads = tape.gradient(total, variables)
+      self.optimizer.apply_gradients(zip(grads, variables))
+      return tf.stack([total] + losses)
+    self._train_step = train_step
+
+    # the same step split in two, for averaging gradients across processes (muzero.parallel)
+    @tf.function(input_signature=[spec(*self.o_shape), spec(K, A), spec(K+1), spec(K+1), spec(K+1, A)])
+    def grad_step(o, a, v, r, p):
+      with tf.GradientTape() as tape:
+        losses = self.unroll_losses(o, a, v, r, p)
+        total = tf.add_n(losses)
+      grads = tape.gradient(total, variables)
+      return tf.stack([total] + losses), tf.concat([tf.reshape(g, [-1]) for g in grads], 0)
+    self._grad_step = grad_step
+
+    @tf.function(input_signature=[tf.TensorSpec((None,), tf.float32)])
+    def apply_step(flat):
+      grads = tf.split(flat, [int(np.prod(v.shape)) for v in variables])
+      self.optimizer.apply_gradients([(tf.reshape(g, v.shape), v) for g, v in zip(grads, variables)])
+    self._apply_step = apply_step
+
+  def compute_gradients(self, o, a, v, r, p):
+    # losses like train_on_arrays and the gradient of the total as one flat float32 vector
+    self.build_training()
+    f32 = lambda x: tf.convert_to_tensor(np.asarray(x, dtype=np.float32))
+    l, flat = self._grad_step(f32(o), f32(a), f32(v), f32(r), f32(p))
+    return l.numpy(), flat.numpy()
+
+  def apply_gradients(self, flat):
+    self.build_training()
+    self._apply_step(tf.convert_to_tensor(np.asarray(flat, dtype=np.float32)))
+
   def create_mu(self, K, lr):
     self.K = K
     # represent
@@ -152,6 +372,10 @@ class MuModel():
       s_km1 = s_k
 
     mu = Model([o_0] + a_all, mu_all)
-    mu.compile(Adam(lr), loss_all)
-    self.mu = mu
+    if self.engine == 'tf':
+      # mu is still used for prediction, e.g. by naive_search
+      self.create_train_step(lr)
+    else:
+      mu.compile(Adam(lr), loss_all)
+    self._mu = mu
 
@@ -0,0 +1,105 @@
+import json
+import numpy as np
+
+# TensorFlow-free forward passes of a trained MuModel for actors
+# the h, g and f networks are stacks of Dense+elu layers followed by linear heads
+
+def numpy_params(m):
+  # meta and {key: array} of the Dense weights of m.h, m.g and m.f
+  arrays = {}
+  for name, net in [('h', m.h), ('g', m.g), ('f', m.f)]:
+    trunk = 0
+    for l in net.layers:
+      kind = l.__class__.__name__
+      if kind == 'BatchNormalization':
+        raise NotImplementedError("numpy export does not support BN")
+      if kind != 'Dense':
+        continue
+      W, b = l.get_weights()
+      if l.name in ('s_0', 's_k', 'r_k', 'v_k', 'p_k'):
+        key = '%s/%s' % (name, l.name)
+      else:
+        if l.activation.__name__ != 'elu':
+          raise NotImplementedError("numpy export only supports elu trunks, got %s" % l.activation.__name__)
+        key = '%s/%d' % (name, trunk)
+        trunk += 1
+      arrays[key + '/W'] = W.astype(np.float32)
+      arrays[key + '/b'] = b.astype(np.float32)
+  meta = {'o_shape': list(m.o_shape), 'a_dim': m.a_dim, 's_dim': m.s_dim,
+          'with_policy': m.with_policy, 'layer_count': trunk}
+  return meta, arrays
+
+def export_numpy(m, path):
+  # write the Dense weights of m.h, m.g and m.f to an .npz file
+  meta, arrays = numpy_params(m)
+  arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+  np.savez(path, **arrays)
+
+def load_numpy(path):
+  with np.load(path) as f:
+    meta = json.loads(f['meta'].tobytes().decode())
+    params = {k: f[k] for k in f.files if k != 'meta'}
+  return NumpyMuModel(meta, params)
+
+def elu(x):
+  return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+class NumpyMuModel():
+  """ht/gt/ft of MuModel on plain numpy arrays, loaded with load_numpy."""
+
+  def __init__(self, meta, params):
+    self.meta = meta
+    self.o_shape = tuple(meta['o_shape'])
+    self.a_dim = meta['a_dim']
+    self.s_dim = meta['s_dim']
+    self.with_policy = meta['with_policy']
+    self.layer_count = meta['layer_count']
+    self.set_params(params)
+
+  def set_params(self, params):
+    self.params = params
+    L = self.layer_count
+    self.trunks = {n: [(params['%s/%d/W' % (n, i)], params['%s/%d/b' % (n, i)]) for i in range(L)] for n in 'hgf'}
+    # split g's first layer so the action is a row lookup instead of a one-hot matmul
+    W, b = self.trunks['g'][0]
+    self.g_Ws, self.g_Wa, self.g_b = W[:self.s_dim], W[self.s_dim:], b
+    head = lambda k: (params[k + '/W'], params[k + '/b'])
+    self.s_0, self.s_k, self.r_k, self.v_k = head('h/s_0'), head('g/s_k'), head('g/r_k'), head('f/v_k')
+    self.p_k = head('f/p_k') if self.with_policy else None
+
+  def _trunk(self, x, layers):
+    for W, b in layers:
+      x = elu(x @ W + b)
+    return x
+
+  # ht, gt and ft take a single sample or a batch, like MuModel
+  def ht(self, o_0):
+    o_0 = np.asarray(o_0, dtype=np.float32)
+    single = o_0.ndim == len(self.o_shape)
+    x = self._trunk(o_0[None] if single else o_0, self.trunks['h'])
+    s_0 = x @ self.s_0[0] + self.s_0[1]
+    return s_0[0] if single else s_0
+
+  def gt(self, s_km1, a_k):
+    s_km1 = np.asarray(s_km1, dtype=np.float32)
+    single = s_km1.ndim == 1
+    s_km1 = s_km1[None] if single else s_km1
+    a_k = np.atleast_1d(np.asarray(a_k))
+    # the -1 padding action contributes nothing, like its zero one-hot row
+    a_rows = np.where((a_k >= 0)[:, None], self.g_Wa[a_k], 0)
+    x = elu(s_km1 @ self.g_Ws + a_rows + self.g_b)
+    x = self._trunk(x, self.trunks['g'][1:])
+    r_k = (x @ self.r_k[0] + self.r_k[1])[:, 0]
+    s_k = x @ self.s_k[0] + self.s_k[1]
+    return (r_k[0], s_k[0]) if single else (r_k, s_k)
+
+  def ft(self, s_k):
+    s_k = np.asarray(s_k, dtype=np.float32)
+    single = s_k.ndim == 1
+    x = self._trunk(s_k[None] if single else s_k, self.trunks['f'])
+    v_k = (x @ self.v_k[0] + self.v_k[1])[:, 0]
+    if self.with_policy:
+      p_k = np.exp(x @ self.p_k[0] + self.p_k[1])
+    else:
+      p_k = np.full((len(v_k), self.a_dim), 1/self.a_dim)
+    return (p_k[0], v_k[0]) if single else (p_k, v_k)
@@ -0,0 +1,134 @@
+import collections
+import multiprocessing as mp
+import os
+import numpy as np
+from muzero.shared import attach_shm, layout, views
+
+# data parallel training of the unrolled mu loss on one box
+# every worker process holds an identical MuModel, computes the gradient on its shard of the batch,
+# writes it to shared memory and then applies the same size weighted average, so the weights never diverge
+
+def flat_weights(m):
+  return np.concatenate([v.numpy().ravel() for v in m.h.trainable_variables + m.g.trainable_variables + m.f.trainable_variables])
+
+def set_flat_weights(m, flat):
+  off = 0
+  for v in m.h.trainable_variables + m.g.trainable_variables + m.f.trainable_variables:
+    n = int(np.prod(v.shape))
+    v.assign(flat[off:off+n].reshape(v.shape))
+    off += n
+
+def shard_layout(world, num_params, num_losses):
+  return layout([
+    ('grads', (world, num_params), np.float32),
+    ('losses', (world, num_losses), np.float64),
+    ('counts', (world,), np.float64),
+    ('weights', (num_params,), np.float32)])
+
+def worker(rank, world, model_kwargs, seed, threads, conn, barrier):
+  if threads:
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+  import tensorflow as tf
+  if threads:
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+  from muzero.model import MuModel
+  tf.random.set_seed(seed)
+  np.random.seed(seed)
+  m = MuModel(**model_kwargs)
+  m.build_training()
+  num_params = len(flat_weights(m))
+  conn.send((num_params, len(m.loss_names())))
+
+  shm = attach_shm(conn.recv())
+  buf = views(shm.buf, shard_layout(world, num_params, len(m.loss_names()))[0])
+  # everyone starts from rank 0's weights
+  if rank == 0:
+    buf['weights'][:] = flat_weights(m)
+  barrier.wait()
+  set_flat_weights(m, buf['weights'])
+
+  while True:
+    cmd = conn.recv()
+    if cmd is None:
+      break
+    if cmd == 'weights':
+      conn.send(m.h.get_weights() + m.g.get_weights() + m.f.get_weights())
+      continue
+    o, a, v, r, p = cmd
+    if len(o) > 0:
+      l, g = m.compute_gradients(o, a, v, r, p)
+    else:
+      l, g = np.zeros(buf['losses'].shape[1]), np.zeros(num_params, dtype=np.float32)
+    buf['grads'][rank] = g
+    buf['losses'][rank] = l
+    buf['counts'][rank] = len(o)
+    barrier.wait()
+    # shard means weighted by shard size are the full batch mean, summed in rank order on every worker
+    w = buf['counts'] / buf['counts'].sum()
+    m.apply_gradients(w @ buf['grads'])
+    if rank == 0:
+      conn.send(w @ buf['losses'])
+    # nobody overwrites grads until everyone has read them
+    barrier.wait()
+  buf = None
+  shm.close()
+
+class DataParallelTrainer():
+  """Trains a MuModel(**model_kwargs) with world worker processes.
+
+  Same seed and same batches give the same weights as a single process MuModel
+  started from the same weights, up to float summation order.
+  """
+
+  def __init__(self, model_kwargs, world=2, seed=0, threads=None, loss_history=10000):
+    ctx = mp.get_context('spawn')
+    self.world = world
+    self.model_kwargs = dict(model_kwargs, engine='tf')
+    self.losses = collections.deque(maxlen=loss_history)
+    barrier = ctx.Barrier(world)
+    self.conns, self.procs = [], []
+    for rank in range(world):
+      parent, child = ctx.Pipe()
+      p = ctx.Process(target=worker, args=(rank, world, self.model_kwargs, seed, threads, child, barrier), daemon=True)
+      p.start()
+      self.conns.append(parent)
+      self.procs.append(p)
+    num_params, num_losses = [c.recv() for c in self.conns][0]
+    from multiprocessing import shared_memory
+    self.shm = shared_memory.SharedMemory(create=True, size=shard_layout(world, num_params, num_losses)[1])
+    for c in self.conns:
+      c.send(self.shm.name)
+
+  def train_on_arrays(self, o, a, v, r, p):
+    # a is one-hot (B, K, a_dim) like MuModel.train_on_arrays
+    for c, idx in zip(self.conns, np.array_split(np.arange(len(o)), self.world)):
+      c.send((o[idx], a[idx], v[idx], r[idx], p[idx]))
+    l = self.conns[0].recv().tolist()
+    self.losses.append(l)
+    return l
+
+  def train_on_batch(self, batch):
+    from muzero.model import batch_arrays, one_hot
+    o, a, v, r, p = batch_arrays(batch)
+    return self.train_on_arrays(o, one_hot(a, self.model_kwargs['a_dim']), v, r, p)
+
+  def get_weights(self):
+    # h, g then f weights of the (identical) worker models
+    self.conns[0].send('weights')
+    return self.conns[0].recv()
+
+  def load_into(self, m):
+    w = self.get_weights()
+    nh, ng = len(m.h.get_weights()), len(m.g.get_weights())
+    m.h.set_weights(w[:nh])
+    m.g.set_weights(w[nh:nh+ng])
+    m.f.set_weights(w[nh+ng:])
+
+  def close(self):
+    for c in self.conns:
+      c.send(None)
+    for p in self.procs:
+      p.join()
+    self.shm.close()
+    self.shm.unlink()
@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+from muzero.model import reformat_batch, train_arrays
+
+class Prefetcher():
+  """Builds training batches on background threads into a bounded queue.
+
+  For engine='tf' (the MuModel default) every item is the o, a, v, r, p arrays for
+  m.train_on_arrays(*item), for engine='keras' it is the X, Y for m.train_on_reformatted(*item).
+  """
+
+  def __init__(self, replay_buffer, a_dim, remove_policy=False, bs=None, num_workers=1, depth=4, telemetry=None,
+               engine='tf'):
+    self.replay_buffer = replay_buffer
+    self.engine = engine
+    # a muzero.stats.TrainTelemetry to report time blocked in get() to
+    self.telemetry = telemetry
+    self.a_dim = a_dim
+    self.remove_policy = remove_policy
+    self.bs = bs
+    self.queue = queue.Queue(maxsize=depth)
+    self.stop = threading.Event()
+    self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+    for w in self.workers:
+      w.start()
+
+  def _work(self):
+    while not self.stop.is_set():
+      try:
+        batch = self.replay_buffer.sample_batch(self.bs)
+        if self.engine == 'tf':
+          item = train_arrays(batch, self.a_dim)
+        else:
+          item = reformat_batch(batch, self.a_dim, self.remove_policy)
+      except Exception as e:
+        # hand the error to the learner instead of dying silently
+        item = e
+      while not self.stop.is_set():
+        try:
+          self.queue.put(item, timeout=0.1)
+          break
+        except queue.Full:
+          pass
+      if isinstance(item, Exception):
+        return
+
+  def get(self):
+    # the learner only ever blocks here
+    st = time.perf_counter()
+    item = self.queue.get()
+    if self.telemetry is not None:
+      self.telemetry.wait(time.perf_counter() - st)
+    if isinstance(item, Exception):
+      raise item
+    return item
+
+  def __iter__(self):
+    while True:
+      yield self.get()
+
+  def close(self):
+    self.stop.set()
+    # unblock any worker waiting on a full queue
+    while True:
+      try:
+        self.queue.get_nowait()
+      except queue.Empty:
+        break
+    for w in self.workers:
+      w.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
@@ -0,0 +1,82 @@
+import json
+import numpy as np
+from muzero.npmodel import NumpyMuModel, numpy_params
+
+# post training quantized inference artifacts for actors
+# int8 stores every Dense kernel as int8 with one float32 scale per output channel,
+# float16 stores kernels as half floats, biases stay float32 in both.
+# numpy has no fast int8 or half matmul, so the runtime dequantizes once at load
+# and then serves ht/gt/ft like NumpyMuModel.
+
+def quantize_int8(W):
+  # symmetric, per output channel
+  scale = np.abs(W).max(axis=0) / 127
+  scale = np.where(scale > 0, scale, 1).astype(np.float32)
+  return np.round(W / scale).astype(np.int8), scale
+
+def export_quantized(m, path, mode='int8'):
+  # m is a MuModel or a NumpyMuModel
+  meta, params = (m.meta, m.params) if isinstance(m, NumpyMuModel) else numpy_params(m)
+  arrays = {}
+  for k, x in params.items():
+    if not k.endswith('/W'):
+      arrays[k] = x.astype(np.float32)
+    elif mode == 'int8':
+      arrays[k + '/q'], arrays[k + '/scale'] = quantize_int8(x)
+    elif mode == 'float16':
+      arrays[k] = x.astype(np.float16)
+    else:
+      raise ValueError("unknown quantization mode %s" % mode)
+  meta = dict(meta, quantization=mode)
+  arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+  np.savez(path, **arrays)
+
+def load_quantized(path):
+  with np.load(path) as f:
+    meta = json.loads(f['meta'].tobytes().decode())
+    arrays = {k: f[k] for k in f.files if k != 'meta'}
+  nbytes = sum(x.nbytes for x in arrays.values())
+  params = {}
+  for k, x in arrays.items():
+    if k.endswith('/scale'):
+      continue
+    if k.endswith('/q'):
+      params[k[:-2]] = x.astype(np.float32) * arrays[k[:-2] + '/scale']
+    else:
+      params[k] = x.astype(np.float32)
+  m = NumpyMuModel(meta, params)
+  m.quantization = meta['quantization']
+  m.artifact_nbytes = nbytes
+  return m
+
+def normalize(p):
+  return p / p.sum(axis=-1, keepdims=True)
+
+def parity_report(ref, quant, observations, actions=None):
+  # how far quant drifts from ref on held-out observations, both need batched ht/gt/ft
+  # actions (one per observation, random if None) probe one step of g as well
+  observations = np.asarray(observations, dtype=np.float32)
+  if actions is None:
+    actions = np.random.randint(0, ref.a_dim, size=len(observations))
+  s_r, s_q = ref.ht(observations), quant.ht(observations)
+  ret = {'positions': len(observations)}
+  if s_r.shape == s_q.shape:
+    ret['state_max_abs'] = float(np.abs(s_r - s_q).max())
+  for name, (a, b) in [('root', (s_r, s_q)), ('step', (ref.gt(s_r, actions)[1], quant.gt(s_q, actions)[1]))]:
+    p_r, v_r = ref.ft(a)
+    p_q, v_q = quant.ft(b)
+    p_r, p_q = normalize(p_r), normalize(p_q)
+    tv = 0.5 * np.abs(p_r - p_q).sum(axis=-1)
+    kl = (p_r * (np.log(p_r + 1e-12) - np.log(p_q + 1e-12))).sum(axis=-1)
+    ret[name] = {
+      'value_mean_abs': float(np.abs(v_r - v_q).mean()),
+      'value_max_abs': float(np.abs(v_r - v_q).max()),
+      'policy_tv_mean': float(tv.mean()),
+      'policy_tv_max': float(tv.max()),
+      'policy_kl_mean': float(kl.mean()),
+      'top1_agreement': float(np.mean(p_r.argmax(-1) == p_q.argmax(-1))),
+    }
+  r_r, r_q = ref.gt(s_r, actions)[0], quant.gt(s_q, actions)[0]
+  ret['step']['reward_mean_abs'] = float(np.abs(r_r - r_q).mean())
+  ret['step']['reward_max_abs'] = float(np.abs(r_r - r_q).max())
+  return ret
@@ -0,0 +1,54 @@
+import time
+from muzero.game import Game
+from muzero.mcts import mcts_search_batch
+
+# lockstep self-play, play_game for many games at once
+# every move searches all the live games with one mcts_search_batch, so the model sees batches
+# instead of single observations, and finished games are replaced straight away to keep the batch full
+
+class SelfPlay():
+  def __init__(self, make_env, m, replay_buffer=None, num_games=16, num_simulations=30, discount=0.99, minimax=True,
+               obs_dtype=None):
+    # make_env() returns a fresh env for every new game
+    self.make_env = make_env
+    self.m = m
+    self.replay_buffer = replay_buffer
+    self.num_simulations = num_simulations
+    self.discount = discount
+    self.minimax = minimax
+    self.obs_dtype = obs_dtype
+    self.games = [self.new_game() for _ in range(num_games)]
+    self.games_played = 0
+    self.moves = 0
+    self.start = time.perf_counter()
+
+  def new_game(self):
+    return Game(self.make_env(), discount=self.discount, obs_dtype=self.obs_dtype)
+
+  def step(self):
+    # one move in every live game, returns the games that finished
+    observations = [game.observation for game in self.games]
+    results = mcts_search_batch(self.m, observations, self.num_simulations, self.minimax)
+    finished = []
+    for i, (game, (policy, _)) in enumerate(zip(self.games, results)):
+      game.act_with_policy(policy)
+      if game.terminal():
+        if self.replay_buffer is not None:
+          self.replay_buffer.save_game(game)
+        finished.append(game)
+        self.games[i] = self.new_game()
+    self.moves += len(results)
+    self.games_played += len(finished)
+    return finished
+
+  def play(self, num_games):
+    # step until num_games more games have finished, returns them
+    ret = []
+    while len(ret) < num_games:
+      ret += self.step()
+    return ret
+
+  def throughput(self):
+    dt = time.perf_counter() - self.start
+    return {'games': self.games_played, 'moves': self.moves,
+            'games_per_sec': self.games_played / dt, 'moves_per_sec': self.moves / dt}
@@ -0,0 +1,144 @@
+import numpy as np
+from multiprocessing import shared_memory
+from muzero.game import batch_list, unroll_targets
+
+def attach_shm(name):
+  try:
+    return shared_memory.SharedMemory(name=name, track=False)
+  except TypeError:
+    # python < 3.13 always tracks, which is harmless for multiprocessing children
+    # since they share the creator's resource tracker
+    return shared_memory.SharedMemory(name=name)
+
+def layout(fields, align=64):
+  # fields is [(name, shape, dtype)], returns {name: (offset, shape, dtype)} and the total size
+  ret, off = {}, 0
+  for name, shape, dtype in fields:
+    ret[name] = (off, shape, np.dtype(dtype))
+    off += int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+    off = (off + align - 1) // align * align
+  return ret, max(off, 1)
+
+def views(buf, lay):
+  return {name: np.ndarray(shape, dtype=dtype, buffer=buf, offset=off) for name, (off, shape, dtype) in lay.items()}
+
+class SharedReplayBuffer():
+  """ReplayBuffer over a ring of fixed size game slots in shared memory.
+
+  Every actor process writes whole trajectories straight into its own stripe of
+  slots (rank, rank+world, ...), so writers never contend. Each slot has a sequence
+  number that is odd while it is being written and even once complete, which lets
+  the learner sample without locks and drop positions that were torn by a write.
+  """
+
+  def __init__(self, num_slots, max_len, obs_shape, a_dim, batch_size, num_unroll_steps,
+               obs_dtype=np.float32, name=None, rank=0, world=1, _create=True):
+    self.num_slots = num_slots
+    self.max_len = max_len
+    self.obs_shape = tuple(obs_shape)
+    self.a_dim = a_dim
+    self.batch_size = batch_size
+    self.num_unroll_steps = num_unroll_steps
+    self.obs_dtype = np.dtype(obs_dtype)
+    self.rank, self.world = rank, world
+
+    S, L = num_slots, max_len
+    self.layout, size = layout([
+      ('seq', (S,), np.int64),
+      ('length', (S,), np.int64),
+      ('obs', (S, L) + self.obs_shape, self.obs_dtype),
+      ('actions', (S, L), np.int64),
+      ('rewards', (S, L), np.float32),
+      ('values', (S, L), np.float32),
+      ('policies', (S, L, a_dim), np.float32)])
+    if _create:
+      self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+      self.owner = True
+    else:
+      self.shm = attach_shm(name)
+      self.owner = False
+    for k, v in views(self.shm.buf, self.layout).items():
+      setattr(self, k, v)
+    if _create:
+      self.seq[:] = 0
+      self.length[:] = 0
+
+    # the next slot in this writer's stripe
+    self._next = rank
+
+  @property
+  def name(self):
+    return self.shm.name
+
+  def attach(self, rank=0, world=1):
+    # a handle on the same buffer for another writer, pickling also attaches by name
+    return SharedReplayBuffer(self.num_slots, self.max_len, self.obs_shape, self.a_dim,
+                              self.batch_size, self.num_unroll_steps, self.obs_dtype,
+                              self.name, rank, world, _create=False)
+
+  def __reduce__(self):
+    return (SharedReplayBuffer, (self.num_slots, self.max_len, self.obs_shape, self.a_dim,
+                                 self.batch_size, self.num_unroll_steps, self.obs_dtype,
+                                 self.name, self.rank, self.world, False))
+
+  def close(self):
+    for k in self.layout:
+      setattr(self, k, None)
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+  def save_game(self, game):
+    n = game.n
+    if n > self.max_len:
+      raise ValueError("game of length %d does not fit in slots of %d" % (n, self.max_len))
+    s = self._next
+    self._next = s + self.world if s + self.world < self.num_slots else self.rank
+
+    # odd while writing
+    self.seq[s] += 1
+    self.length[s] = n
+    self.obs[s, :n] = game.observations
+    self.actions[s, :n] = game.history
+    self.rewards[s, :n] = game.rewards
+    self.values[s, :n] = game.values()
+    self.policies[s, :n] = game.policies
+    self.seq[s] += 1
+
+  def complete(self):
+    seq = self.seq.copy()
+    return np.flatnonzero((seq > 0) & (seq % 2 == 0)), seq
+
+  def sample_arrays(self, bs=None):
+    # uniform over stored positions, returns the batch as arrays
+    # obs (B, ...), actions (B, K), values (B, K+1), rewards (B, K+1), policies (B, K+1, a_dim)
+    bs = self.batch_size if bs is None else bs
+    K = self.num_unroll_steps
+    slots, seq = self.complete()
+    if len(slots) == 0:
+      raise ValueError("no complete games in the buffer")
+    cum = np.cumsum(self.length[slots])
+    r = np.random.randint(0, cum[-1], size=bs)
+    j = np.searchsorted(cum, r, side='right')
+    s = slots[j]
+    pos = r - (cum[j] - self.length[s])
+
+    # the slots as flat columns, slot s is rows s*max_len onwards
+    L = self.max_len
+    flat = lambda x: x.reshape((-1,) + x.shape[2:])
+    start = (s * L)[:, None]
+    end = start + self.length[s][:, None]
+    idx = start + pos[:, None] + np.arange(K + 1)
+    obs = self.obs[s, pos]
+    actions, values, rewards, policies = unroll_targets(flat(self.actions), flat(self.values), flat(self.rewards),
+                                                        flat(self.policies), idx, start, end)
+
+    # drop anything a writer touched while we were reading
+    ok = self.seq[s] == seq[s]
+    if not ok.all():
+      obs, actions, values, rewards, policies = obs[ok], actions[ok], values[ok], rewards[ok], policies[ok]
+    return obs, actions, values, rewards, policies
+
+  def sample_batch(self, bs=None):
+    # same format as ReplayBuffer.sample_batch
+    return batch_list(*self.sample_arrays(bs))
@@ -0,0 +1,223 @@
+import collections
+import json
+import time
+import numpy as np
+
+class Window():
+  """Fixed memory ring holding the last n values of a series."""
+
+  def __init__(self, n=4096):
+    self.x = np.zeros(n)
+    self.i = 0
+    self.count = 0
+
+  def add(self, v):
+    self.x[self.i] = v
+    self.i = (self.i + 1) % len(self.x)
+    self.count += 1
+
+  def extend(self, vs):
+    vs = np.asarray(vs, dtype=np.float64)[-len(self.x):]
+    idx = (self.i + np.arange(len(vs))) % len(self.x)
+    self.x[idx] = vs
+    self.i = (self.i + len(vs)) % len(self.x)
+    self.count += len(vs)
+
+  def values(self):
+    return self.x[:min(self.count, len(self.x))]
+
+  def summary(self, qs=(50, 90, 99)):
+    v = self.values()
+    if len(v) == 0:
+      return {}
+    ret = {'mean': float(v.mean())}
+    for q, p in zip(qs, np.percentile(v, qs)):
+      ret['p%d' % q] = float(p)
+    ret['max'] = float(v.max())
+    return ret
+
+class Rate():
+  # events per second over the last n updates
+  def __init__(self, n=64):
+    self.t = collections.deque(maxlen=n)
+
+  def add(self, total):
+    self.t.append((time.perf_counter(), total))
+
+  def rate(self):
+    if len(self.t) < 2:
+      return 0.0
+    (t0, c0), (t1, c1) = self.t[0], self.t[-1]
+    return (c1 - c0) / (t1 - t0) if t1 > t0 else 0.0
+
+class ReplayStats():
+  """Ingest, sample age, reuse and sample time counters for a ReplayBuffer."""
+
+  def __init__(self, window=4096):
+    self.start = time.perf_counter()
+    self.games_saved = 0
+    self.positions_saved = 0
+    self.game_rate = Rate()
+    self.position_rate = Rate()
+
+    self.batches = 0
+    self.samples = 0
+    self.sample_time = 0.0
+    self.sample_times = Window(window)
+    # age of a sampled position, in positions and games ingested after it
+    self.age_positions = Window(window)
+    self.age_games = Window(window)
+
+    # reuse of positions that have left the buffer
+    self.evicted_positions = 0
+    self.evicted_samples = 0
+    self.evicted_unsampled = 0
+
+  def on_save(self, game):
+    game.replay_game_serial = self.games_saved
+    game.replay_position_serial = self.positions_saved
+    game.sample_counts = np.zeros(game.n, dtype=np.int32)
+    self.games_saved += 1
+    self.positions_saved += game.n
+    self.game_rate.add(self.games_saved)
+    self.position_rate.add(self.positions_saved)
+
+  def on_evict(self, game):
+    self.evicted_positions += game.n
+    self.evicted_samples += int(game.sample_counts.sum())
+    self.evicted_unsampled += int(np.sum(game.sample_counts == 0))
+
+  def on_sample(self, game_pos, dt):
+    self.batches += 1
+    self.samples += len(game_pos)
+    self.sample_time += dt
+    self.sample_times.add(dt)
+    for g, i in game_pos:
+      g.sample_counts[i] += 1
+    self.age_positions.extend([self.positions_saved - g.replay_position_serial - i - 1 for g, i in game_pos])
+    self.age_games.extend([self.games_saved - g.replay_game_serial - 1 for g, _ in game_pos])
+
+  def snapshot(self):
+    elapsed = time.perf_counter() - self.start
+    return {
+      'time': time.time(),
+      'elapsed': elapsed,
+      'games_saved': self.games_saved,
+      'positions_saved': self.positions_saved,
+      'games_per_sec': self.game_rate.rate(),
+      'positions_per_sec': self.position_rate.rate(),
+      'batches': self.batches,
+      'samples': self.samples,
+      # how many times each ingested position has been trained on, on average
+      'replay_ratio': self.samples / self.positions_saved if self.positions_saved else 0.0,
+      'evicted_reuse': self.evicted_samples / self.evicted_positions if self.evicted_positions else 0.0,
+      'evicted_unsampled_frac': self.evicted_unsampled / self.evicted_positions if self.evicted_positions else 0.0,
+      'sample_time': self.sample_time,
+      'sample_time_frac': self.sample_time / elapsed if elapsed > 0 else 0.0,
+      'sample_batch_sec': self.sample_times.summary(),
+      'age_positions': self.age_positions.summary(),
+      'age_games': self.age_games.summary(),
+    }
+
+  def emit(self, f):
+    # append one JSONL record to a path or open file
+    line = json.dumps(self.snapshot()) + "\n"
+    if isinstance(f, str):
+      with open(f, "a") as fp:
+        fp.write(line)
+    else:
+      f.write(line)
+      f.flush()
+
+class TrainTelemetry():
+  """Fixed memory training statistics with periodic JSONL or CSV snapshots.
+
+  MuModel.train_on_* calls step() and a Prefetcher calls wait(), so memory stays
+  constant however long the run is.
+  """
+
+  def __init__(self, path=None, every=60.0, window=1024, alpha=0.01):
+    self.path = path
+    # csv if the path says so, jsonl otherwise
+    self.csv = path is not None and path.endswith('.csv')
+    self.every = every
+    self.window = window
+    self.alpha = alpha
+    self.names = None
+    self.ema = None
+    self.heads = None
+    self.step_times = Window(window)
+    self.wait_times = Window(window)
+    self.sample_rate = Rate(window)
+    self.steps = 0
+    self.samples = 0
+    self.step_time = 0.0
+    self.wait_time = 0.0
+    self.start = time.perf_counter()
+    self.last_write = self.start
+    self.csv_keys = None
+
+  def set_names(self, names):
+    self.names = list(names)
+
+  def step(self, losses, dt, batch_size):
+    losses = np.asarray(losses, dtype=np.float64)
+    if self.ema is None:
+      if self.names is None or len(self.names) != len(losses):
+        self.names = ['loss_%d' % i for i in range(len(losses))]
+      self.ema = losses.copy()
+      self.heads = [Window(self.window) for _ in losses]
+    self.ema += self.alpha * (losses - self.ema)
+    for w, l in zip(self.heads, losses):
+      w.add(l)
+    self.steps += 1
+    self.samples += batch_size
+    self.step_time += dt
+    self.step_times.add(dt)
+    self.sample_rate.add(self.samples)
+    if self.path is not None and time.perf_counter() - self.last_write >= self.every:
+      self.write()
+
+  def wait(self, dt):
+    # time the learner spent blocked on data
+    self.wait_time += dt
+    self.wait_times.add(dt)
+
+  def snapshot(self):
+    ret = {
+      'time': time.time(),
+      'elapsed': time.perf_counter() - self.start,
+      'steps': self.steps,
+      'samples': self.samples,
+      'samples_per_sec': self.sample_rate.rate(),
+      'step_sec': self.step_times.summary(),
+      'wait_sec': self.wait_times.summary(),
+      'wait_frac': self.wait_time / (self.wait_time + self.step_time) if self.wait_time + self.step_time > 0 else 0.0,
+    }
+    if self.ema is not None:
+      for name, e, w in zip(self.names, self.ema, self.heads):
+        ret[name] = dict(ema=float(e), **w.summary())
+    return ret
+
+  def write(self):
+    self.last_write = time.perf_counter()
+    snap = self.snapshot()
+    with open(self.path, 'a') as f:
+      if not self.csv:
+        f.write(json.dumps(snap) + "\n")
+        return
+      flat = flatten(snap)
+      if self.csv_keys is None:
+        self.csv_keys = sorted(flat)
+        if f.tell() == 0:
+          f.write(",".join(self.csv_keys) + "\n")
+      f.write(",".join(str(flat.get(k, '')) for k in self.csv_keys) + "\n")
+
+def flatten(d, prefix=''):
+  ret = {}
+  for k, v in d.items():
+    if isinstance(v, dict):
+      ret.update(flatten(v, prefix + k + '.'))
+    else:
+      ret[prefix + k] = v
+  return ret
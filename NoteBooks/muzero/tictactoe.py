@@ -0,0 +1,115 @@
+import numpy as np
+
+# Tic Tac Toe from muzero_tictactoe.ipynb on bitboards
+# state is [9 cells of 1/-1/0, finished flag (the value when the game ended), player to move]
+# each player's stones are a 9 bit mask and WIN[mask] says whether it holds a line
+
+LINES = [(0,1,2), (3,4,5), (6,7,8), (0,3,6), (1,4,7), (2,5,8), (0,4,8), (2,4,6)]
+LINE_MASKS = [sum(1 << i for i in line) for line in LINES]
+WIN = np.array([any(m & l == l for l in LINE_MASKS) for m in range(512)])
+BITS = 1 << np.arange(9)
+
+def masks(s):
+  p = m = 0
+  for i in range(9):
+    if s[i] == 1:
+      p |= 1 << i
+    elif s[i] == -1:
+      m |= 1 << i
+  return p, m
+
+def masks_batch(S):
+  return (S[:, :9] == 1) @ BITS, (S[:, :9] == -1) @ BITS
+
+class TicTacToe():
+  def __init__(self, state=None):
+    self.reset()
+    if state is not None:
+      self.state = state
+
+  def reset(self):
+    self.done = False
+    self.state = [0]*11
+    self.state[-1] = 1
+    return self.state
+
+  class observation_space():
+    shape = (11,)
+
+  class action_space():
+    n = 9
+
+  def render(self):
+    print("turn %d" % self.state[-1])
+    print(np.array(self.state[0:9]).reshape(3,3))
+
+  def value(self, s):
+    # NOTE: this is not the value, the state may be won
+    p, m = masks(s)
+    ret = 1 if WIN[p] else (-1 if WIN[m] else 0)
+    return ret*s[-1]
+
+  def dynamics(self, s, act):
+    rew = 0
+    s = s.copy()
+    if s[act] != 0 or s[-2] != 0:
+      # don't move in taken spots or in finished games
+      rew = -10
+    else:
+      s[act] = s[-1]
+      rew += self.value(s)
+    if s[-2] != 0:
+      rew = 0
+    else:
+      s[-2] = self.value(s)
+    s[-1] = -s[-1]
+    return rew, s
+
+  def step(self, act):
+    rew, self.state = self.dynamics(self.state, act)
+    if rew != 0:
+      self.done = True
+    if all(x != 0 for x in self.state[0:9]):
+      self.done = True
+    return self.state, rew, self.done, None
+
+  # the same on (N, 11) integer arrays of states
+  def value_batch(self, S):
+    p, m = masks_batch(S)
+    return np.where(WIN[p], 1, np.where(WIN[m], -1, 0)) * S[:, -1]
+
+  def dynamics_batch(self, S, acts):
+    S = np.array(S)
+    acts = np.asarray(acts)
+    idx = np.arange(len(S))
+    finished = S[:, -2] != 0
+    illegal = (S[idx, acts] != 0) | finished
+    ok = ~illegal
+    S[idx[ok], acts[ok]] = S[ok, -1]
+    v = self.value_batch(S)
+    rew = np.where(illegal, -10, v)
+    rew = np.where(finished, 0, rew)
+    S[~finished, -2] = v[~finished]
+    S[:, -1] = -S[:, -1]
+    return rew, S
+
+class MockModel():
+  """A perfect model of TicTacToe for testing search, ht/gt/ft also take (N, 11) batches."""
+
+  a_dim = 9
+
+  def __init__(self, env=None):
+    self.env = TicTacToe() if env is None else env
+
+  def ht(self, s):
+    return s
+
+  def gt(self, s, a):
+    if np.ndim(s) == 2:
+      return self.env.dynamics_batch(s, a)
+    return self.env.dynamics(s, a)
+
+  def ft(self, s):
+    if np.ndim(s) == 2:
+      return np.full((len(s), 9), 1/9), self.env.value_batch(np.asarray(s))
+    return np.array([1/9]*9), self.env.value(s)
@@ -0,0 +1,271 @@
+import argparse
+import copy
+import json
+import multiprocessing as mp
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+
+# end to end training with acting and learning running at the same time
+#   python -m muzero.train config.json
+#   python -m muzero.train --print-config > config.json
+# actors are processes running lockstep self-play (muzero.selfplay) on a TensorFlow-free copy of the model,
+# kept fresh through shared memory by a muzero.broadcast.WeightPublisher. finished games come back over a queue
+# into the learner's ReplayBuffer, and the learner trains from a Prefetcher while they play.
+# replay_ratio is the number of trained samples per generated position: the learner waits for data when it is
+# ahead and the actors pause when they are more than replay_slack positions ahead.
+
+DEFAULTS = {
+  'env': 'tictactoe',
+  'discount': 0.99,
+  'seed': 0,
+  'model': {'s_dim': 8, 'K': 5, 'lr': 0.001, 'with_policy': True, 'layer_count': None, 'layer_dim': None},
+  'search': {'num_simulations': 30, 'minimax': None, 'games_per_actor': 16},
+  'replay': {'window_size': 1000, 'batch_size': 128, 'min_games': 32, 'compress': None},
+  'actors': 2,
+  'replay_ratio': 4.0,
+  'replay_slack': 2000,
+  'train_steps': 10000,
+  'publish_every': 10,
+  'log_every': 100,
+  'telemetry': None,
+  'eval': {'every': 1000, 'episodes': 50, 'workers': 1, 'opponent': None, 'num_simulations': 30},
+  'checkpoint': {'directory': None, 'every': 1000, 'keep': 3},
+}
+
+def merge(base, override):
+  ret = copy.deepcopy(base)
+  for k, v in override.items():
+    if isinstance(v, dict) and isinstance(ret.get(k), dict):
+      ret[k] = merge(ret[k], v)
+    else:
+      ret[k] = v
+  return ret
+
+def load_config(path=None):
+  if path is None:
+    return copy.deepcopy(DEFAULTS)
+  with open(path) as f:
+    return merge(DEFAULTS, json.load(f))
+
+def actor(actor_id, cfg, subscriber, games, stop, positions, trained):
+  from muzero.arena import make_env
+  from muzero.selfplay import SelfPlay
+  random.seed(cfg['seed'] + actor_id)
+  np.random.seed(cfg['seed'] + actor_id)
+  search = cfg['search']
+  minimax = cfg['env'] == 'tictactoe' if search['minimax'] is None else search['minimax']
+  while not subscriber.refresh():
+    if stop.is_set():
+      return
+    time.sleep(0.01)
+  sp = SelfPlay(lambda: make_env(cfg['env']), subscriber.model, None, search['games_per_actor'],
+                search['num_simulations'], cfg['discount'], minimax)
+  while not stop.is_set():
+    # don't run more than replay_slack positions ahead of the learner
+    if positions.value * cfg['replay_ratio'] > trained.value + cfg['replay_slack'] * cfg['replay_ratio']:
+      time.sleep(0.01)
+      continue
+    subscriber.refresh()
+    for game in sp.step():
+      games.put((game.observations, game.history, game.rewards, game.policies, game.discount, subscriber.version))
+      with positions.get_lock():
+        positions.value += game.n
+
+def check_actors(procs, drainer):
+  if drainer.error is not None:
+    raise drainer.error
+  if not any(p.is_alive() for p in procs):
+    raise RuntimeError("all actors exited, exit codes %s" % [p.exitcode for p in procs])
+
+class Drainer():
+  """Moves actor games from the queue into the replay buffer until close() is called after the actors have exited."""
+
+  def __init__(self, games, replay_buffer):
+    self.games = games
+    self.replay_buffer = replay_buffer
+    self.done = threading.Event()
+    self.error = None
+    self.thread = threading.Thread(target=self._work, daemon=True)
+    self.thread.start()
+
+  def _work(self):
+    from muzero.game import Game
+    while not self.done.is_set():
+      try:
+        o, a, r, p, discount, _ = self.games.get(timeout=0.1)
+      except queue.Empty:
+        continue
+      try:
+        self.replay_buffer.save_game(Game.from_arrays(o, a, r, p, discount))
+      except Exception as e:
+        # hand the error to the learner, check_actors raises it
+        self.error = e
+        return
+
+  def close(self):
+    self.done.set()
+    self.thread.join()
+
+class Evaluator():
+  """Runs muzero.arena on an export of the model in a background thread, one evaluation at a time."""
+
+  def __init__(self, cfg, directory):
+    self.cfg = cfg
+    self.directory = directory
+    self.thread = None
+    self.reports = []
+
+  def start(self, m, step):
+    from muzero.npmodel import export_numpy
+    if self.thread is not None and self.thread.is_alive():
+      return False
+    path = os.path.join(self.directory, "eval-%010d.npz" % step)
+    export_numpy(m, path)
+    self.thread = threading.Thread(target=self._run, args=(path, step), daemon=True)
+    self.thread.start()
+    return True
+
+  def _run(self, path, step):
+    from muzero.arena import evaluate
+    e = self.cfg['eval']
+    try:
+      ret = evaluate(self.cfg['env'], 'numpy:' + path, e['opponent'], e['episodes'], e['workers'], e['num_simulations'])
+      print("eval step %d: %.3f +- %.3f, agent %.1f moves/sec" % (step, ret['score_mean'], ret['score_ci95'],
+                                                                 ret['agent_moves_per_sec']))
+    except Exception as ex:
+      # a failed eval shows up in the reports and the summary instead of an older result
+      ret = {'error': repr(ex)}
+      print("eval step %d failed: %r" % (step, ex))
+    finally:
+      os.remove(path)
+    ret['step'] = step
+    self.reports.append(ret)
+    with open(os.path.join(self.directory, "eval.jsonl"), 'a') as f:
+      f.write(json.dumps(ret) + "\n")
+
+  def wait(self):
+    if self.thread is not None:
+      self.thread.join()
+
+def train(cfg, directory=None):
+  """Runs cfg (see DEFAULTS) and returns the trained MuModel and a summary dict."""
+  import tempfile
+  from muzero.arena import make_env
+  from muzero.broadcast import WeightPublisher
+  from muzero.checkpoint import Checkpointer
+  from muzero.game import ReplayBuffer
+  from muzero.model import MuModel
+  from muzero.prefetch import Prefetcher
+  from muzero.stats import TrainTelemetry
+
+  random.seed(cfg['seed'])
+  np.random.seed(cfg['seed'])
+  env = make_env(cfg['env'])
+  mc = cfg['model']
+  telemetry = TrainTelemetry(cfg['telemetry']) if cfg['telemetry'] else None
+  m = MuModel(env.observation_space.shape, env.action_space.n, s_dim=mc['s_dim'], K=mc['K'], lr=mc['lr'],
+              with_policy=mc['with_policy'], layer_count=mc['layer_count'], layer_dim=mc['layer_dim'],
+              telemetry=telemetry)
+  rc = cfg['replay']
+  replay_buffer = ReplayBuffer(rc['window_size'], rc['batch_size'], mc['K'], compress=rc['compress'])
+
+  cc = cfg['checkpoint']
+  directory = directory or cc['directory'] or tempfile.mkdtemp(prefix="muzero-")
+  os.makedirs(directory, exist_ok=True)
+  checkpointer = Checkpointer(directory, cc['keep'])
+  step = checkpointer.restore(m, replay_buffer) or 0
+  if step:
+    print("resuming from step %d" % step)
+
+  ctx = mp.get_context('spawn')
+  # a slot per actor plus the newest and the one being written, so no actor's weights change under it
+  publisher = WeightPublisher(m, max_actors=cfg['actors'], nslots=cfg['actors'] + 2)
+  publisher.publish(m)
+  games, stop = ctx.Queue(maxsize=256), ctx.Event()
+  positions, trained = ctx.Value('d', 0.0), ctx.Value('d', 0.0)
+  procs = [ctx.Process(target=actor, args=(i, cfg, publisher.subscriber(i), games, stop, positions, trained), daemon=True)
+           for i in range(cfg['actors'])]
+  for p in procs:
+    p.start()
+  drainer = Drainer(games, replay_buffer)
+  evaluator = Evaluator(cfg, directory)
+  prefetcher = None
+
+  st = time.perf_counter()
+  samples, start_step = 0, step
+  try:
+    while len(replay_buffer.buffer) < rc['min_games']:
+      check_actors(procs, drainer)
+      time.sleep(0.1)
+    prefetcher = Prefetcher(replay_buffer, m.a_dim, not m.with_policy, telemetry=telemetry, engine=m.engine)
+    while step < cfg['train_steps']:
+      # hold the learner back to replay_ratio samples per position
+      if (samples + rc['batch_size']) > cfg['replay_ratio'] * positions.value:
+        # no more data is coming if the actors are gone
+        check_actors(procs, drainer)
+        time.sleep(0.005)
+        continue
+      if drainer.error is not None:
+        # don't keep training on a buffer that gets no new games
+        raise drainer.error
+      item = prefetcher.get()
+      l = m.train_on_arrays(*item) if m.engine == 'tf' else m.train_on_reformatted(*item)
+      step += 1
+      samples += rc['batch_size']
+      trained.value = samples
+      if step % cfg['publish_every'] == 0:
+        publisher.publish(m)
+      if step % cfg['log_every'] == 0:
+        print("step %d loss %.4f games %d positions %d ratio %.2f actor lag %s" % (
+          step, l[0], replay_buffer.games_saved, positions.value, samples / max(positions.value, 1), publisher.lag()))
+      if cc['every'] and step % cc['every'] == 0:
+        checkpointer.save(m, step, replay_buffer)
+      if cfg['eval']['every'] and step % cfg['eval']['every'] == 0:
+        evaluator.start(m, step)
+  finally:
+    stop.set()
+    if prefetcher is not None:
+      prefetcher.close()
+    for p in procs:
+      p.join(timeout=5)
+      if p.is_alive():
+        p.terminate()
+    drainer.close()
+    publisher.close()
+  checkpointer.save(m, step, replay_buffer)
+  checkpointer.close()
+  evaluator.wait()
+  dt = time.perf_counter() - st
+  summary = {'steps': step, 'games': replay_buffer.games_saved, 'positions': int(positions.value),
+             'replay_ratio': samples / max(positions.value, 1), 'steps_per_sec': (step - start_step) / dt,
+             'positions_per_sec': positions.value / dt, 'directory': directory,
+             'eval': evaluator.reports[-1] if evaluator.reports else None}
+  if telemetry is not None:
+    telemetry.write()
+  return m, summary
+
+def main():
+  parser = argparse.ArgumentParser(description="MuZero training with concurrent actors and learner")
+  parser.add_argument('config', nargs='?', help="JSON file overriding muzero.train.DEFAULTS")
+  parser.add_argument('--steps', type=int, help="override train_steps")
+  parser.add_argument('--actors', type=int, help="override actors")
+  parser.add_argument('--directory', help="checkpoint and eval directory, override checkpoint.directory")
+  parser.add_argument('--print-config', action='store_true', help="print the merged config and exit")
+  args = parser.parse_args()
+  cfg = load_config(args.config)
+  if args.steps is not None:
+    cfg['train_steps'] = args.steps
+  if args.actors is not None:
+    cfg['actors'] = args.actors
+  if args.print_config:
+    print(json.dumps(cfg, indent=2))
+    return
+  _, summary = train(cfg, args.directory)
+  print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,156 @@
+import glob
+import os
+import numpy as np
+from muzero.game import Game, batch_list, unroll_targets
+
+# columnar archives of finished games for offline training and warm starts
+# an archive is a directory of shard-NNNNNN directories, each holding one .npy file per field:
+#   observations (N, ...), actions (N,), rewards (N,), policies (N, a_dim), values (N,)  one row per position
+#   offsets (G+1,), discount (G,)                                                      one row per game
+# game g of a shard is rows offsets[g]:offsets[g+1], values are its discounted returns.
+# the reader memory maps the shards, so sampling only touches the rows it draws
+
+FIELDS = ['observations', 'actions', 'rewards', 'policies', 'values']
+
+class TrajectoryWriter():
+  """Appends games to an archive, writing a shard every shard_positions positions."""
+
+  def __init__(self, directory, shard_positions=65536, obs_dtype=None):
+    self.directory = directory
+    self.shard_positions = shard_positions
+    self.obs_dtype = obs_dtype
+    os.makedirs(directory, exist_ok=True)
+    # after the newest shard, older ones may have been pruned
+    self.shard = max([shard_index(p) for p in shard_paths(directory)], default=-1) + 1
+    self.games_written = 0
+    self._reset()
+
+  def _reset(self):
+    self.columns = {k: [] for k in FIELDS}
+    self.lengths = []
+    self.discounts = []
+    self.positions = 0
+
+  def write(self, game):
+    obs = game.observations
+    self.columns['observations'].append(obs.astype(self.obs_dtype) if self.obs_dtype is not None else obs)
+    self.columns['actions'].append(np.asarray(game.history, dtype=np.int64))
+    self.columns['rewards'].append(np.asarray(game.rewards, dtype=np.float64))
+    self.columns['policies'].append(np.asarray(game.policies, dtype=np.float64))
+    self.columns['values'].append(game.values())
+    self.lengths.append(game.n)
+    self.discounts.append(game.discount)
+    self.positions += game.n
+    self.games_written += 1
+    if self.positions >= self.shard_positions:
+      self.flush()
+
+  def flush(self):
+    if not self.lengths:
+      return
+    path = os.path.join(self.directory, "shard-%06d" % self.shard)
+    # write next to the final name and rename, so readers never see half a shard
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for k, v in self.columns.items():
+      np.save(os.path.join(tmp, k + ".npy"), np.concatenate(v))
+    np.save(os.path.join(tmp, "offsets.npy"), np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64))
+    np.save(os.path.join(tmp, "discount.npy"), np.array(self.discounts, dtype=np.float64))
+    if os.path.exists(path):
+      raise FileExistsError("%s already exists, is another writer appending to %s?" % (path, self.directory))
+    os.replace(tmp, path)
+    self.shard += 1
+    self._reset()
+
+  def close(self):
+    self.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def shard_paths(directory):
+  return sorted(p for p in glob.glob(os.path.join(directory, "shard-*")) if not p.endswith(".tmp"))
+
+def shard_index(path):
+  return int(os.path.basename(path)[len("shard-"):])
+
+def export_replay(replay_buffer, directory, shard_positions=65536, obs_dtype=None):
+  # every game currently in a ReplayBuffer
+  with replay_buffer.lock:
+    games = list(replay_buffer.buffer)
+  with TrajectoryWriter(directory, shard_positions, obs_dtype) as w:
+    for game in games:
+      w.write(game)
+
+class TrajectoryReader():
+  """Memory mapped view of an archive, samples batches like ReplayBuffer."""
+
+  def __init__(self, directory, batch_size=None, num_unroll_steps=5, mmap=True):
+    self.batch_size = batch_size
+    self.num_unroll_steps = num_unroll_steps
+    mode = 'r' if mmap else None
+    self.shards = []
+    for path in shard_paths(directory):
+      self.shards.append({k: np.load(os.path.join(path, k + ".npy"), mmap_mode=mode)
+                          for k in FIELDS + ['offsets', 'discount']})
+    if not self.shards:
+      raise ValueError("no shards in %s" % directory)
+    self.shard_games = np.cumsum([len(s['discount']) for s in self.shards])
+    self.shard_positions = np.cumsum([int(s['offsets'][-1]) for s in self.shards])
+
+  def __len__(self):
+    return int(self.shard_games[-1])
+
+  @property
+  def num_positions(self):
+    return int(self.shard_positions[-1])
+
+  def game(self, i, env=None):
+    j = int(np.searchsorted(self.shard_games, i, side='right'))
+    s = self.shards[j]
+    g = i - (int(self.shard_games[j-1]) if j > 0 else 0)
+    a, b = int(s['offsets'][g]), int(s['offsets'][g+1])
+    return Game.from_arrays(s['observations'][a:b], s['actions'][a:b], s['rewards'][a:b], s['policies'][a:b],
+                            float(s['discount'][g]), env)
+
+  def games(self, start=0, env=None):
+    for i in range(start, len(self)):
+      yield self.game(i, env)
+
+  def sample_arrays(self, bs=None):
+    # uniform over archived positions, same arrays as SharedReplayBuffer.sample_arrays
+    bs = self.batch_size if bs is None else bs
+    K = self.num_unroll_steps
+    r = np.random.randint(0, self.num_positions, size=bs)
+    sj = np.searchsorted(self.shard_positions, r, side='right')
+    order, parts = [], []
+    for j in np.unique(sj):
+      s = self.shards[j]
+      b = np.nonzero(sj == j)[0]
+      rows = r[b] - (self.shard_positions[j-1] if j > 0 else 0)
+      offsets = np.asarray(s['offsets'])
+      g = np.searchsorted(offsets, rows, side='right') - 1
+      start, end = offsets[g][:, None], offsets[g+1][:, None]
+      idx = rows[:, None] + np.arange(K + 1)
+      obs = s['observations'][rows]
+      actions, values, rewards, policies = unroll_targets(s['actions'], s['values'], s['rewards'], s['policies'],
+                                                          idx, start, end)
+      order.append(b)
+      parts.append((obs, actions, values, rewards, policies))
+    # back in draw order
+    inv = np.argsort(np.concatenate(order))
+    return tuple(np.concatenate(c)[inv] for c in zip(*parts))
+
+  def sample_batch(self, bs=None):
+    # same format as ReplayBuffer.sample_batch
+    return batch_list(*self.sample_arrays(bs))
+
+def warm_start(replay_buffer, directory, env=None):
+  # fill a ReplayBuffer with the newest games of an archive
+  reader = TrajectoryReader(directory, mmap=True)
+  for game in reader.games(max(0, len(reader) - replay_buffer.window_size), env):
+    replay_buffer.save_game(game)
+  return reader